@@ -0,0 +1,77 @@
+import datetime
+import threading
+from collections import Counter
+
+BEST_SELLERS = 5
+RECENT_DAYS = 7  # days in the orders-over-time chart
+
+class SalesAnalytics:
+    """Running dashboard aggregates, updated as orders come in and close instead of rescanned per page load"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.revenue = 0
+        self.open_by_status = Counter()  # orders still open
+        self.closed_by_status = Counter()  # sales logs
+        self.product_sales = Counter()  # sales logs per product
+        self.daily = Counter()  # sales logs per YYYY-MM-DD
+
+    def _add_sales_log(self, log, sign=1):
+        total = log.get("total")
+        if isinstance(total, (int, float)):
+            self.revenue += sign * total
+        self.closed_by_status[log.get("status")] += sign
+        self.product_sales[log.get("product")] += sign
+        if log.get("date"):
+            self.daily[log["date"]] += sign
+
+    def rebuild(self, orders, sales_logs):
+        """Recompute everything from storage, e.g. at startup"""
+        with self._lock:
+            self._reset()
+            for order in orders:
+                self.open_by_status[order.get("status")] += 1
+            for log in sales_logs:
+                self._add_sales_log(log)
+
+    def order_added(self, order):
+        with self._lock:
+            self.open_by_status[order.get("status")] += 1
+
+    def order_updated(self, old_status, order, closed):
+        """An open order changed status; closed means it moved to the sales logs"""
+        with self._lock:
+            self.open_by_status[old_status] -= 1
+            if closed:
+                self._add_sales_log(order)
+            else:
+                self.open_by_status[order.get("status")] += 1
+
+    def sales_logs_removed(self, logs):
+        with self._lock:
+            for log in logs:
+                self._add_sales_log(log, sign=-1)
+
+    def snapshot(self, today=None):
+        """The /analyzeai figures: totals, status counts, best sellers and the last RECENT_DAYS days"""
+        today = today or datetime.date.today()
+        with self._lock:
+            days = [(today - datetime.timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(RECENT_DAYS - 1, -1, -1)]
+            recent = [(day, self.daily[day]) for day in days if self.daily[day] > 0]
+            best = [(product, count) for product, count in self.product_sales.most_common() if count > 0][:BEST_SELLERS]
+            return {
+                "total_earnings": self.revenue,
+                "total_orders": sum(self.closed_by_status.values()) + sum(self.open_by_status.values()),
+                "preparing_orders": self.open_by_status["Preparing"],
+                "shipping_orders": self.open_by_status["Shipping"],
+                "delivering_orders": self.open_by_status["Delivering"],
+                "delivered_orders": self.closed_by_status["Delivered"],
+                "canceled_orders": self.closed_by_status["Canceled"],
+                "best_selling_products": best,
+                "orders_over_time": recent,
+            }
+
+analytics = SalesAnalytics()
@@ -4,7 +4,6 @@ import logging
 from flask_cors import CORS
 import requests
 import messageHandler
-from github import Github
 from functools import wraps
 import hashlib
 from dotenv import load_dotenv
@@ -21,6 +20,17 @@ import threading
 import telegram_bot
 import discord_bot
 import page_bot
+from usage_stats import usage_tracker
+from response_cache import response_cache
+from intent_router import intent_router
+from session_manager import session_manager
+from image_matcher import cascade_stats
+from image_features import feature_store
+from image_jobs import image_jobs
+from image_result_cache import image_result_cache
+from key_pool import key_pool
+from github_sync import github_sync
+from analytics import analytics
 
 load_dotenv()
 
@@ -36,9 +46,6 @@ GITHUB_REPO_NAME = os.getenv("GITHUB_REPO_NAME")
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
 
-github = Github(GITHUB_ACCESS_TOKEN)
-repo = github.get_repo(GITHUB_REPO_NAME)
-
 AI_ENABLED = True
 
 def login_required(f):
@@ -135,7 +142,6 @@ def order_lists():
             new_status = request.form.get('status')
             messageHandler.update_order_status(order_index, new_status)
             flash("Order status updated successfully!", "success")
-            messageHandler.update_github_repo_orders(messageHandler.get_orders())
         return redirect(url_for('order_lists'))
 
     return render_template('orderlists.html', title="Order Lists", orders=messageHandler.get_orders(), AI_ENABLED=AI_ENABLED)
@@ -148,7 +154,6 @@ def view_order(order_index):
         new_status = request.form.get('status')
         messageHandler.update_order_status(order_index, new_status)
         flash("Order status updated successfully!", "success")
-        messageHandler.update_github_repo_orders(messageHandler.get_orders())
         return redirect(url_for('order_lists'))
     
     return render_template('vieworder.html', title="View Order", order=order, order_index=order_index, settings=messageHandler.get_settings())
@@ -180,8 +185,10 @@ def download_saleslog():
         filename = f"sales_log_{uuid.uuid4().hex}.txt"
         filepath = os.path.join(temp_dir, filename)
         
+        # Optional ?from=YYYY-MM-DD&to=YYYY-MM-DD only reads the months in that range
+        logs = messageHandler.get_sales_logs(request.args.get('from') or None, request.args.get('to') or None)
         with open(filepath, 'w') as f:
-            for log in messageHandler.sales_logs:
+            for log in logs:
                 f.write(f"Name: {log.get('name', 'N/A')}\n")
                 f.write(f"Mobile: {log.get('mobile', 'N/A')}\n")
                 f.write(f"Address: {log.get('address', 'N/A')}\n")
@@ -254,53 +261,62 @@ def download_single_order(order_index):
 @app.route('/analyzeai')
 @login_required
 def analyze_ai():
-    total_earnings = sum(order['total'] for order in messageHandler.sales_logs if 'total' in order)
-    total_orders = len(messageHandler.sales_logs) + len(messageHandler.get_orders())
-    delivered_orders = len([order for order in messageHandler.sales_logs if order['status'] == 'Delivered'])
-    canceled_orders = len([order for order in messageHandler.sales_logs if order['status'] == 'Canceled'])
-    preparing_orders = len([order for order in messageHandler.get_orders() if order['status'] == 'Preparing'])
-    shipping_orders = len([order for order in messageHandler.get_orders() if order['status'] == 'Shipping'])
-    delivering_orders = len([order for order in messageHandler.get_orders() if order['status'] == 'Delivering'])
-
-    from collections import defaultdict
-    product_sales = defaultdict(int)
-    for order in messageHandler.sales_logs:
-        product_sales[order['product']] += 1
-    best_selling_products = sorted(product_sales.items(), key=lambda x: x[1], reverse=True)[:5]
-    best_selling_products_labels = [product[0] for product in best_selling_products]
-    best_selling_products_data = [product[1] for product in best_selling_products]
-
-    from datetime import datetime, timedelta
-    orders_over_time = defaultdict(int)
-    for order in messageHandler.sales_logs:
-        order_date = datetime.strptime(order['date'], "%Y-%m-%d")
-        if order_date >= datetime.now() - timedelta(days=7):
-            orders_over_time[order_date.strftime("%Y-%m-%d")] += 1
-    orders_over_time_labels = sorted(orders_over_time.keys())
-    orders_over_time_data = [orders_over_time[date] for date in orders_over_time_labels]
-
-    max_earnings = max(total_earnings, 1)
-    max_orders = max(total_orders, 1)
+    figures = analytics.snapshot()
+    best_selling_products = figures['best_selling_products']
+    orders_over_time = figures['orders_over_time']
 
     return render_template(
         'analyzeai.html',
         title="Analyze AI",
-        total_earnings=total_earnings,
-        total_orders=total_orders,
-        preparing_orders=preparing_orders,
-        delivered_orders=delivered_orders,
-        canceled_orders=canceled_orders,
-        shipping_orders=shipping_orders,
-        delivering_orders=delivering_orders,
-        best_selling_products_labels=best_selling_products_labels,
-        best_selling_products_data=best_selling_products_data,
-        orders_over_time_labels=orders_over_time_labels,
-        orders_over_time_data=orders_over_time_data,
-        max_earnings=max_earnings,
-        max_orders=max_orders,
+        total_earnings=figures['total_earnings'],
+        total_orders=figures['total_orders'],
+        preparing_orders=figures['preparing_orders'],
+        delivered_orders=figures['delivered_orders'],
+        canceled_orders=figures['canceled_orders'],
+        shipping_orders=figures['shipping_orders'],
+        delivering_orders=figures['delivering_orders'],
+        best_selling_products_labels=[product for product, _ in best_selling_products],
+        best_selling_products_data=[count for _, count in best_selling_products],
+        orders_over_time_labels=[date for date, _ in orders_over_time],
+        orders_over_time_data=[count for _, count in orders_over_time],
+        max_earnings=max(figures['total_earnings'], 1),
+        max_orders=max(figures['total_orders'], 1),
         settings=messageHandler.get_settings()
     )
 
+@app.route('/api/analytics')
+@login_required
+def analytics_json():
+    return jsonify(analytics.snapshot())
+
+@app.route('/usage')
+@login_required
+def usage():
+    return render_template('usage.html', title="AI Usage", usage=usage_tracker.summary(),
+                           response_cache=response_cache.stats(), intent_router=intent_router.stats(),
+                           sessions=session_manager.stats(), image_matching=cascade_stats.stats(),
+                           image_features=feature_store.stats(), image_jobs=image_jobs.stats(),
+                           image_cache=image_result_cache.stats(), github_sync=github_sync.stats(),
+                           gemini_keys=key_pool.stats(), circuit_breaker=messageHandler.llm_circuit_breaker.stats(),
+                           settings=messageHandler.get_settings())
+
+@app.route('/api/usage')
+@login_required
+def usage_json():
+    return jsonify({
+        **usage_tracker.summary(),
+        "response_cache": response_cache.stats(),
+        "intent_router": intent_router.stats(),
+        "sessions": session_manager.stats(),
+        "image_matching": cascade_stats.stats(),
+        "image_features": feature_store.stats(),
+        "image_jobs": image_jobs.stats(),
+        "image_cache": image_result_cache.stats(),
+        "github_sync": github_sync.stats(),
+        "gemini_keys": key_pool.stats(),
+        "circuit_breaker": messageHandler.llm_circuit_breaker.stats(),
+    })
+
 @app.route('/stocklists', methods=['GET', 'POST'])
 @login_required
 def stock_lists():
@@ -315,27 +331,24 @@ def stock_lists():
                 "image": request.form.get('image'),
                 "price": int(request.form.get('price'))
             }
-            messageHandler.products.append(new_product)
+            messageHandler.add_product(new_product)
             flash("Product added successfully!", "success")
-            messageHandler.update_github_repo(messageHandler.products)
         elif action == 'edit':
             product_index = int(request.form.get('product_index'))
-            messageHandler.products[product_index] = {
+            messageHandler.update_product(product_index, {
                 "category": request.form.get('category'),
                 "type": request.form.get('type'),
                 "size": [s.strip() for s in request.form.get('size').split(',')],
                 "color": [c.strip() for c in request.form.get('color').split(',')],
                 "image": request.form.get('image'),
                 "price": int(request.form.get('price'))
-            }
+            })
             flash("Product updated successfully!", "success")
-            messageHandler.update_github_repo(messageHandler.products)
         elif action == 'remove':
             product_index = int(request.form.get('product_index'))
             product_image = messageHandler.products[product_index]['image']
-            messageHandler.products.pop(product_index)
+            messageHandler.remove_product(product_index)
             flash("Product removed successfully!", "success")
-            messageHandler.update_github_repo(messageHandler.products)
             
             if product_image:
                 try:
@@ -377,7 +390,6 @@ def ship_setup():
             settings = messageHandler.get_settings()
             settings['delivery_records'].append(new_record)
             messageHandler.update_settings(delivery_records=settings['delivery_records'])
-            messageHandler.update_github_repo_settings(settings)
             flash("Delivery record added successfully!", "success")
         elif action == 'edit':
             record_index = int(request.form.get('record_index'))
@@ -389,14 +401,12 @@ def ship_setup():
                 'delivery_charge': int(request.form.get('delivery_charge'))
             }
             messageHandler.update_settings(delivery_records=settings['delivery_records'])
-            messageHandler.update_github_repo_settings(settings)
             flash("Delivery record updated successfully!", "success")
         elif action == 'remove':
             record_index = int(request.form.get('record_index'))
             settings = messageHandler.get_settings()
             settings['delivery_records'].pop(record_index)
             messageHandler.update_settings(delivery_records=settings['delivery_records'])
-            messageHandler.update_github_repo_settings(settings)
             flash("Delivery record removed successfully!", "success")
         return redirect(url_for('ship_setup'))
 
@@ -446,8 +456,6 @@ def ai_settings():
             return_policy=return_policy
         )
 
-        messageHandler.update_github_repo_settings(messageHandler.get_settings())
-
         flash("Settings updated successfully!", "success")
         return redirect(url_for('ai_settings'))
 
@@ -459,7 +467,7 @@ def api():
     if not query:
         return jsonify({"error": "No query provided"}), 400
    
-    response, _ = messageHandler.handle_text_message(query, last_message=None)
+    response, _ = messageHandler.handle_text_message(query, last_message=None, platform="api")
    
     return jsonify(response) 
 
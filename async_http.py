@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import weakref
+import aiohttp
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=20, sock_connect=5, sock_read=10)
+
+# The Telegram and Discord bots each run their own event loop, so every loop gets its own session
+_sessions = weakref.WeakKeyDictionary()
+
+def get_session():
+    """Shared aiohttp session for the running event loop"""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(timeout=DEFAULT_TIMEOUT)
+        _sessions[loop] = session
+    return session
+
+async def fetch_json(url, **kwargs):
+    async with get_session().get(url, **kwargs) as response:
+        response.raise_for_status()
+        return await response.json(content_type=None)
+
+async def fetch_bytes(url, max_bytes=None, **kwargs):
+    """Download a URL; returns None on a non-200 response or a body larger than max_bytes"""
+    async with get_session().get(url, **kwargs) as response:
+        if response.status != 200:
+            logger.error(f"Download of {url} failed with status {response.status}")
+            return None
+        if max_bytes is None:
+            return await response.read()
+        if response.content_length and response.content_length > max_bytes:
+            logger.error(f"Download of {url} refused: {response.content_length} bytes")
+            return None
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            body.extend(chunk)
+            if len(body) > max_bytes:
+                logger.error(f"Download of {url} stopped at {max_bytes} bytes")
+                return None
+        return bytes(body)
+
+async def close_session():
+    loop = asyncio.get_running_loop()
+    session = _sessions.pop(loop, None)
+    if session is not None and not session.closed:
+        await session.close()
@@ -0,0 +1,38 @@
+import time
+
+STREAM_EDIT_INTERVAL = 1.0  # seconds between progressive edits; Telegram and Discord rate-limit message edits
+ERROR_TEXT = "Sorry, I encountered an error processing your message."
+
+def has_product_image(response):
+    return " - http" in response and any(ext in response.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif'])
+
+def split_product_image(response):
+    """(caption, image URL) from a "[Product] - [Image URL]" response"""
+    parts = response.split(" - ")
+    return parts[0], parts[-1].strip()
+
+async def stream_reply(chunks, send, edit, interval=STREAM_EDIT_INTERVAL):
+    """Send the reply as soon as the first text arrives, then edit it in place as Gemini continues.
+    send(text) returns the sent message and edit(message, text) changes it; returns (message, final text)"""
+    sent = None
+    shown = ""
+    text = ""
+    last_edit = 0.0
+    async for chunk in chunks:
+        text += chunk
+        now = time.monotonic()
+        # Compare trimmed text: the platform trims what it shows, and an edit that changes nothing is rejected
+        if text.strip() != shown and now - last_edit >= interval:
+            if sent is None:
+                sent = await send(text)
+            else:
+                await edit(sent, text)
+            shown = text.strip()
+            last_edit = now
+
+    text = text.strip()
+    if sent is None:
+        sent = await send(text or ERROR_TEXT)
+    elif text != shown:
+        await edit(sent, text)
+    return sent, text
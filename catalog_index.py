@@ -0,0 +1,136 @@
+import re
+import math
+from collections import Counter, defaultdict
+
+# Field weights: a hit on the product type or category counts more than a colour or size hit
+FIELD_WEIGHTS = {"type": 2, "category": 2, "color": 1, "size": 1}
+BM25_K1 = 1.2
+BM25_B = 0.75
+HISTORY_WEIGHT = 0.3  # recent conversation turns count less than the current message
+
+STOPWORDS = {
+    "a", "an", "and", "any", "are", "can", "do", "does", "for", "give", "have", "how", "i",
+    "in", "is", "it", "me", "much", "my", "of", "please", "price", "show", "the", "to",
+    "want", "what", "which", "with", "you", "your",
+}
+
+MAX_SIZE_VALUE = 60  # a bare range up to this (e.g. 38-40) reads as sizes unless a price word or currency sits next to it
+
+BANGLA_DIGITS = str.maketrans("০১২৩৪৫৬৭৮৯", "0123456789")
+
+_token_re = re.compile(r"\w+", re.UNICODE)
+_between_re = re.compile(r"(?:(size|সাইজ)\s*)?(between\s*)?(\d{2,6})\s*(?:-|–|to|and|থেকে)\s*(\d{2,6})")
+_price_before_re = re.compile(r"(?:(?<![a-z])(?:tk|taka|bdt|prices?|dam|budget|under|within)|৳|দাম)\W*(?:\w+\W+){0,2}$")
+_currency_after_re = re.compile(r"\s*(?:(?:tk|taka|bdt)(?![a-z])|৳|টাকা)")
+_max_re = re.compile(r"(?:under|below|less than|within|max(?:imum)?|upto|up to|<)\s*(\d{2,6})|(\d{2,6})\s*(?:\w+\s*)?(?:er moddhe|er niche|এর মধ্যে|এর নিচে|এর কমে)")
+_min_re = re.compile(r"(?:above|over|more than|min(?:imum)?|>)\s*(\d{2,6})|(\d{2,6})\s*(?:\w+\s*)?(?:er upore|এর উপরে|এর বেশি)")
+
+def _stem(token):
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+def tokenize(text):
+    tokens = _token_re.findall(str(text).lower().translate(BANGLA_DIGITS))
+    return [_stem(t) for t in tokens if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+def parse_price_range(text):
+    """Return (min_price, max_price) from phrases like 'under 900' or '500-900'; None for open ends"""
+    text = str(text).lower().translate(BANGLA_DIGITS)
+    for match in _between_re.finditer(text):
+        if match.group(1):
+            continue  # "size 38-40"
+        low, high = sorted((int(match.group(3)), int(match.group(4))))
+        cued = _price_before_re.search(text[:match.start()]) or _currency_after_re.match(text, match.end())
+        if match.group(2) or high > MAX_SIZE_VALUE or cued:
+            return low, high
+    low = high = None
+    match = _max_re.search(text)
+    if match:
+        high = int(match.group(1) or match.group(2))
+    match = _min_re.search(text)
+    if match:
+        low = int(match.group(1) or match.group(2))
+    return low, high
+
+def _in_range(product, price_range):
+    low, high = price_range
+    price = product.get("price", 0)
+    return (low is None or price >= low) and (high is None or price <= high)
+
+class CatalogIndex:
+    """BM25 inverted index over product type, category, colour and size"""
+
+    def __init__(self, products):
+        self.products = list(products)
+        self.postings = defaultdict(dict)  # token -> {product position: weighted term frequency}
+        self.lengths = []
+        for position, product in enumerate(self.products):
+            counts = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                value = product.get(field, "")
+                values = value if isinstance(value, (list, tuple)) else [value]
+                for token in tokenize(" ".join(map(str, values))):
+                    counts[token] += weight
+            for token, frequency in counts.items():
+                self.postings[token][position] = frequency
+            self.lengths.append(sum(counts.values()))
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+
+    def _idf(self, token):
+        count = len(self.postings.get(token, ()))
+        total = len(self.products)
+        return math.log(1 + (total - count + 0.5) / (count + 0.5))
+
+    def _score(self, query_weights):
+        scores = defaultdict(float)
+        for token, query_weight in query_weights.items():
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = self._idf(token)
+            for position, frequency in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[position] / (self.average_length or 1))
+                scores[position] += query_weight * idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return scores
+
+    def search(self, query, history="", top_n=8):
+        """Return up to top_n products relevant to the message, honouring any price range it mentions"""
+        query_weights = Counter()
+        for token in tokenize(query):
+            query_weights[token] += 1.0
+        for token in tokenize(history):
+            query_weights[token] += HISTORY_WEIGHT
+
+        price_range = parse_price_range(query)
+        has_range = price_range != (None, None)
+        scores = self._score(query_weights)
+
+        if not scores and has_range:
+            # Budget questions without a product word: cheapest matches in range first
+            matches = [p for p in self.products if _in_range(p, price_range)]
+            return sorted(matches, key=lambda p: p.get("price", 0))[:top_n]
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        for position, _ in ranked:
+            product = self.products[position]
+            if has_range and not _in_range(product, price_range):
+                continue
+            results.append(product)
+            if len(results) >= top_n:
+                break
+        return results
+
+def format_category_summary(products, currency):
+    """One line per category with item count and price range, used when nothing matches"""
+    categories = defaultdict(list)
+    for product in products:
+        categories[product.get("category", "Other")].append(product)
+    lines = []
+    for category, items in categories.items():
+        prices = [p.get("price", 0) for p in items]
+        types = ", ".join(p.get("type", "") for p in items[:5])
+        more = f" and {len(items) - 5} more" if len(items) > 5 else ""
+        lines.append(f"{category}: {len(items)} items ({types}{more}), {min(prices)}-{max(prices)}{currency}")
+    return "\n".join(lines)
@@ -0,0 +1,19 @@
+import asyncio
+import weakref
+
+class ChatLocks:
+    """One asyncio.Lock per chat, so a customer's messages are answered one at a time and in order"""
+
+    def __init__(self):
+        # A lock lives only while some handler holds or waits on it
+        self._locks = weakref.WeakValueDictionary()
+
+    def get(self, platform, user_id):
+        key = (platform, str(user_id))
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+chat_locks = ChatLocks()
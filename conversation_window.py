@@ -0,0 +1,123 @@
+import os
+import re
+from order_index import extract_mobiles
+from usage_stats import estimate_tokens
+from intent_router import match_products
+from order_parser import ORDER_PLACED
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1200"))  # verbatim turns kept per session
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "250"))  # running summary of older turns
+MAX_TURN_TOKENS = 400  # a single pasted wall of text is clipped rather than pushing everything else out
+MIN_RECENT_TURNS = 2
+GIST_LENGTH = 100  # characters of each older customer message kept in the summary
+
+ORDER_FIELDS = ("name", "mobile", "address", "product")
+
+# "My name is ...", "Name: ...", "amar nam ...", "নাম: ..."
+_name_re = re.compile(r"(?:my name is|name\s*[:\-]|amar nam|আমার নাম|নাম\s*[:\-])\s*([^\n,।.]+)", re.IGNORECASE)
+_address_re = re.compile(r"(?:my address is|address\s*[:\-]|thikana\s*[:\-]?|ঠিকানা\s*[:\-]?)\s*([^\n]+)", re.IGNORECASE)
+
+# What the assistant's question was about, so a bare answer like "Rahim" can be filed under it
+QUESTION_CUES = {
+    "name": ("name", "নাম"),
+    "mobile": ("mobile", "phone", "number", "মোবাইল", "নম্বর"),
+    "address": ("address", "ঠিকানা"),
+}
+
+def clip(text, max_tokens=MAX_TURN_TOKENS):
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # estimate_tokens counts ~4 utf-8 bytes per token
+    clipped = text.encode("utf-8")[:max_tokens * 4].decode("utf-8", "ignore")
+    return clipped.rstrip() + " …"
+
+def split_window(turns, budget=HISTORY_TOKEN_BUDGET, min_recent=MIN_RECENT_TURNS):
+    """Split turns into (older, recent), recent being the newest turns that fit the token budget"""
+    used = 0
+    cut = len(turns)
+    while cut > 0:
+        tokens = estimate_tokens(turns[cut - 1]["text"])
+        if used + tokens > budget and len(turns) - cut >= min_recent:
+            break
+        used += tokens
+        cut -= 1
+    # The window follows the instruction acknowledgement, so it has to open with a customer turn
+    while cut < len(turns) and turns[cut]["role"] != "user":
+        cut += 1
+    return turns[:cut], turns[cut:]
+
+def _asked_fields(text):
+    lowered = text.lower()
+    if "?" not in lowered and "।" not in lowered:
+        return []
+    return [field for field, cues in QUESTION_CUES.items() if any(cue in lowered for cue in cues)]
+
+class ConversationSummary:
+    """Running summary of the turns that fell out of the window, plus the order being collected"""
+
+    def __init__(self, lines=None, order=None, covered_until=None):
+        self.lines = list(lines or [])
+        self.order = dict(order or {})
+        self.covered_until = covered_until  # timestamp of the newest turn folded in
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(data.get("lines"), data.get("order"), data.get("covered_until"))
+
+    def to_dict(self):
+        return {"lines": self.lines, "order": self.order, "covered_until": self.covered_until}
+
+    def note_turn(self, role, text, products, asked=()):
+        """Pick order details out of one turn; returns the fields the assistant just asked for"""
+        if role == "model":
+            if ORDER_PLACED in text:
+                product = self.order.get("product")
+                self.order = {}
+                self.lines.append(f"Order placed{f' for {product}' if product else ''}.")
+            return _asked_fields(text)
+
+        mobiles = extract_mobiles(text)
+        if mobiles:
+            self.order["mobile"] = mobiles[-1]
+        name = _name_re.search(text)
+        if name:
+            self.order["name"] = name.group(1).strip()
+        address = _address_re.search(text)
+        if address:
+            self.order["address"] = address.group(1).strip()
+        matches = match_products(text, products)
+        if len(matches) == 1:
+            self.order["product"] = matches[0]["type"]
+
+        # A short reply to "What is your name?" is the name itself
+        if len(asked) == 1 and not (mobiles or name or address) and len(text.split()) <= 12:
+            self.order[asked[0]] = text.strip()
+        return []
+
+    def absorb(self, turns, products):
+        """Fold turns that no longer fit the window into the summary"""
+        asked = []
+        for turn in turns:
+            asked = self.note_turn(turn["role"], turn["text"], products, asked)
+            if turn["role"] == "user" and not turn["text"].startswith("["):
+                gist = " ".join(turn["text"].split())
+                self.lines.append(f"Customer: {gist[:GIST_LENGTH]}{'…' if len(gist) > GIST_LENGTH else ''}")
+            if turn.get("ts"):
+                self.covered_until = turn["ts"]
+        # Oldest lines go first once the summary outgrows its budget
+        while len(self.lines) > 1 and estimate_tokens("\n".join(self.lines)) > SUMMARY_TOKEN_BUDGET:
+            self.lines.pop(0)
+
+    def order_text(self):
+        return "\n".join(f"- {field.title()}: {self.order[field]}" for field in ORDER_FIELDS if self.order.get(field))
+
+    def render(self):
+        """Prompt section for the summary, empty when nothing has been summarized yet"""
+        parts = []
+        if self.lines:
+            parts.append("## Earlier Conversation (summary)\n" + "\n".join(self.lines) + "\n\n")
+        order = self.order_text()
+        if order:
+            parts.append(f"## Order In Progress\nDetails the customer already gave:\n{order}\n\n")
+        return "".join(parts)
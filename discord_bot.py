@@ -3,11 +3,14 @@ import logging
 import discord
 from discord.ext import commands
 import asyncio
-from messageHandler import handle_text_message
+from messageHandler import handle_image_attachments_async, stream_text_message_async, IMAGE_ACK_REPLY
 from dotenv import load_dotenv
-import requests
+import async_http
+from image_loader import MAX_IMAGE_BYTES
 from io import BytesIO
-from memory_manager import update_user_memory, get_conversation_history
+from memory_manager import update_user_memory
+from chat_locks import chat_locks
+from bot_replies import ERROR_TEXT, has_product_image, split_product_image, stream_reply
 
 # Load environment variables
 load_dotenv()
@@ -21,12 +24,36 @@ logger = logging.getLogger(__name__)
 
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 
+async def send_product_image(channel, response):
+    """Send the product photo and caption for a "[Product] - [Image URL]" response"""
+    try:
+        product_text, image_url = split_product_image(response)
+        
+        # Download image without blocking the event loop
+        image_bytes = await async_http.fetch_bytes(image_url, max_bytes=MAX_IMAGE_BYTES)
+        if image_bytes:
+            # Send image with proper file handling
+            await channel.send(
+                content=product_text,
+                file=discord.File(BytesIO(image_bytes), filename='product.png')
+            )
+        else:
+            await channel.send(response)
+    except Exception as e:
+        logger.error(f"Error processing image URL for Discord: {str(e)}")
+        await channel.send(response)
+
 class DiscordBot(commands.Bot):
     def __init__(self):
         intents = discord.Intents.default()
         intents.message_content = True
         super().__init__(command_prefix='!', intents=intents)
 
+    async def close(self):
+        # The aiohttp session used for product photo downloads belongs to this event loop
+        await async_http.close_session()
+        await super().close()
+
     async def on_ready(self):
         logger.info(f'Logged in as {self.user} (ID: {self.user.id})')
         logger.info('------')
@@ -43,88 +70,60 @@ class DiscordBot(commands.Bot):
             await self.process_commands(message)
             return
 
+        # Messages from different customers run concurrently, but each customer's are answered in order
+        async with chat_locks.get("discord", message.author.id):
+            await self._reply(message)
+
+    async def _reply(self, message):
         try:
             user_id = str(message.author.id)
             message_text = message.content
             
             # Handle attachments (images)
-            if message.attachments:
-                for attachment in message.attachments:
-                    if 'image' in attachment.content_type:
-                        image_url = attachment.url
-                        message_text = f"image_url: {image_url}"
-                        update_user_memory("discord", user_id, "[User sent an image]")
-                        
-                        # Process the image directly through messageHandler
-                        response, matched_product = handle_text_message(message_text, "[Image attachment]")
-                        
-                        if matched_product:
-                            update_user_memory("discord", user_id, response)
-                        
-                        # Send the response
-                        if " - http" in response and any(ext in response.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif']):
-                            try:
-                                parts = response.split(" - ")
-                                product_text = parts[0]
-                                image_url = parts[-1].strip()
-                                
-                                # Download image
-                                image_response = requests.get(image_url)
-                                if image_response.status_code == 200:
-                                    # Send image with proper file handling
-                                    await message.channel.send(
-                                        content=product_text,
-                                        file=discord.File(BytesIO(image_response.content), filename='product.png')
-                                    )
-                                else:
-                                    await message.channel.send(response)
-                            except Exception as e:
-                                logger.error(f"Error processing image URL for Discord: {str(e)}")
-                                await message.channel.send(response)
-                        else:
-                            await message.channel.send(response)
-                        return
+            image_urls = [
+                attachment.url for attachment in message.attachments
+                if attachment.content_type and 'image' in attachment.content_type
+            ]
+            if image_urls:
+                for _ in image_urls:
+                    await asyncio.to_thread(update_user_memory, "discord", user_id, "[User sent an image]", "user")
+                
+                # Acknowledge straight away; matching runs in the image worker pool while other messages are served
+                await message.channel.send(IMAGE_ACK_REPLY)
+                async with message.channel.typing():
+                    replies = await handle_image_attachments_async(image_urls, "discord", user_id)
+                for response, matched_product in replies:
+                    if matched_product:
+                        await asyncio.to_thread(update_user_memory, "discord", user_id, response, "model")
+                    
+                    # Send the response
+                    if has_product_image(response):
+                        await send_product_image(message.channel, response)
+                    else:
+                        await message.channel.send(response)
+                return
             
             if message_text:
-                update_user_memory("discord", user_id, message_text)
-            
-            # Get conversation history
-            conversation_history = get_conversation_history("discord", user_id)
-            full_message = f"Conversation so far:\n{conversation_history}\n\nUser: {message_text}"
-            
-            # Process the message through your existing handler
-            response, matched_product = handle_text_message(full_message, message_text)
+                await asyncio.to_thread(update_user_memory, "discord", user_id, message_text, "user")
             
-            # Update memory with the response if it's not an image
-            if not (" - http" in response and any(ext in response.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif'])):
-                update_user_memory("discord", user_id, response)
+            # Earlier turns come from the user's live chat session
+            # Show typing straight away and stream the reply into a single, progressively edited message
+            async with message.channel.typing():
+                sent, response = await stream_reply(
+                    stream_text_message_async(message_text, message_text, "discord", user_id),
+                    message.channel.send, lambda sent, text: sent.edit(content=text)
+                )
             
-            # Check if response contains an image URL
-            if " - http" in response and any(ext in response.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif']):
-                try:
-                    parts = response.split(" - ")
-                    product_text = parts[0]
-                    image_url = parts[-1].strip()
-                    
-                    # Download image
-                    image_response = requests.get(image_url)
-                    if image_response.status_code == 200:
-                        # Send image with proper file handling
-                        await message.channel.send(
-                            content=product_text,
-                            file=discord.File(BytesIO(image_response.content), filename='product.png')
-                        )
-                    else:
-                        await message.channel.send(response)
-                except Exception as e:
-                    logger.error(f"Error processing image URL for Discord: {str(e)}")
-                    await message.channel.send(response)
+            # Swap the streamed text for the product photo when the reply links one
+            if has_product_image(response):
+                await sent.delete()
+                await send_product_image(message.channel, response)
             else:
-                await message.channel.send(response)
+                await asyncio.to_thread(update_user_memory, "discord", user_id, response, "model")
                 
         except Exception as e:
             logger.error(f"Error in Discord on_message: {str(e)}")
-            await message.channel.send("Sorry, I encountered an error processing your message.")
+            await message.channel.send(ERROR_TEXT)
 
 def run_discord_bot():
     if not DISCORD_TOKEN:
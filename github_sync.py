@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from github import Github, GithubException, InputGitTreeElement, RateLimitExceededException
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GITHUB_SYNC_INTERVAL = float(os.getenv("GITHUB_SYNC_INTERVAL", "60"))  # seconds between batched commits
+GITHUB_SYNC_URGENT_DELAY = float(os.getenv("GITHUB_SYNC_URGENT_DELAY", "5"))  # seconds an urgent change (orders) waits for others to join its commit
+GITHUB_SYNC_MAX_FILES = int(os.getenv("GITHUB_SYNC_MAX_FILES", "50"))  # commit early once this many files are waiting
+GITHUB_SYNC_BRANCH = os.getenv("GITHUB_SYNC_BRANCH", "main")
+MIN_BACKOFF = 30  # seconds after a failed commit; doubles on each failure in a row
+MAX_BACKOFF = 900
+
+def _is_rate_limited(error):
+    if isinstance(error, RateLimitExceededException):
+        return True
+    # Secondary rate limits come back as a plain 403/429
+    return isinstance(error, GithubException) and error.status in (403, 429) and "rate limit" in str(error).lower()
+
+def _retry_after(error):
+    """Seconds GitHub asked us to wait, from Retry-After or the rate limit reset time; None if it didn't say"""
+    headers = getattr(error, "headers", None) or {}
+    headers = {key.lower(): value for key, value in headers.items()}
+    if str(headers.get("retry-after", "")).isdigit():
+        return int(headers["retry-after"])
+    if str(headers.get("x-ratelimit-reset", "")).isdigit():
+        return max(int(headers["x-ratelimit-reset"]) - time.time(), 0)
+    return None
+
+class GitHubSync:
+    """Write-behind mirror of local files in the GitHub repo: changes are held in memory and pushed as one commit per interval"""
+
+    def __init__(self, token=None, repo_name=None, branch=GITHUB_SYNC_BRANCH,
+                 interval=GITHUB_SYNC_INTERVAL, max_files=GITHUB_SYNC_MAX_FILES, urgent_delay=GITHUB_SYNC_URGENT_DELAY):
+        self.token = token or os.getenv("GITHUB_ACCESS_TOKEN")
+        self.repo_name = repo_name or os.getenv("GITHUB_REPO_NAME")
+        self.branch = branch
+        self.interval = interval
+        self.max_files = max_files
+        self.urgent_delay = urgent_delay
+        self._dirty = {}  # path -> latest content, or None to delete; later writes to a path replace earlier ones
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._urgent = False
+        self._repo = None
+        self._thread = None
+        self._backoff = 0
+        self._retry_at = 0
+        self.commits = 0
+        self.files_synced = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.rate_limited = 0
+
+    def _get_repo(self):
+        # One authenticated client for the life of the process
+        if self._repo is None:
+            self._repo = Github(self.token).get_repo(self.repo_name)
+        return self._repo
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="github-sync", daemon=True)
+            self._thread.start()
+
+    def mark_dirty(self, path, content, urgent=False):
+        """Queue a file for the next commit; non-strings are stored as JSON, callables are read at commit time, urgent files go out within urgent_delay"""
+        if not isinstance(content, str) and not callable(content):
+            content = json.dumps(content, indent=2)
+        with self._lock:
+            if path in self._dirty:
+                self.coalesced += 1
+            self._dirty[path] = content
+            self._urgent = self._urgent or urgent
+            pending = len(self._dirty)
+            self._start()
+        if urgent or pending >= self.max_files:
+            self._wake.set()
+
+    def mark_deleted(self, path):
+        """Queue a file's removal for the next commit"""
+        with self._lock:
+            if path in self._dirty:
+                self.coalesced += 1
+            self._dirty[path] = None
+            self._start()
+
+    def read(self, path):
+        """Current text of a file: the pending local version if there is one, else GitHub's; None if it doesn't exist"""
+        with self._lock:
+            pending = path in self._dirty
+            content = self._dirty.get(path)
+        if pending:
+            return content() if callable(content) else content
+        try:
+            return self._get_repo().get_contents(path, ref=self.branch).decoded_content.decode("utf-8")
+        except GithubException as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def list_dir(self, directory):
+        """Paths of the files in a repo directory, pending changes included; [] if it doesn't exist"""
+        try:
+            paths = {item.path for item in self._get_repo().get_contents(directory, ref=self.branch)}
+        except GithubException as e:
+            if e.status != 404:
+                raise
+            paths = set()
+        prefix = directory.rstrip("/") + "/"
+        with self._lock:
+            for path, content in self._dirty.items():
+                if path.startswith(prefix):
+                    if content is None:
+                        paths.discard(path)
+                    else:
+                        paths.add(path)
+        return sorted(paths)
+
+    def _commit(self, files):
+        repo = self._get_repo()
+        ref = repo.get_git_ref(f"heads/{self.branch}")
+        parent = repo.get_git_commit(ref.object.sha)
+        elements = [
+            InputGitTreeElement(path, "100644", "blob", content=content)
+            for path, content in files.items() if content is not None
+        ]
+        deleted = [path for path, content in files.items() if content is None]
+        if deleted:
+            # A removal of a path the tree doesn't have is rejected, e.g. a file created and deleted between commits
+            existing = {item.path for item in repo.get_git_tree(parent.tree.sha, recursive=True).tree}
+            elements += [InputGitTreeElement(path, "100644", "blob", sha=None) for path in deleted if path in existing]
+        if not elements:
+            return
+        tree = repo.create_git_tree(elements, parent.tree)
+        names = ", ".join(sorted(files)[:3]) + (f" and {len(files) - 3} more" if len(files) > 3 else "")
+        commit = repo.create_git_commit(f"Sync {len(files)} file(s) via chatbot: {names}", tree, [parent])
+        ref.edit(commit.sha)
+
+    def flush(self):
+        """Commit everything pending in one commit; True if there was nothing to do or it succeeded"""
+        with self._flush_lock:
+            with self._lock:
+                files, self._dirty = self._dirty, {}
+            if not files:
+                return True
+            try:
+                self._commit({path: content() if callable(content) else content for path, content in files.items()})
+            except Exception as e:
+                with self._lock:
+                    # Put the batch back unless a newer version of a file arrived meanwhile
+                    for path, content in files.items():
+                        self._dirty.setdefault(path, content)
+                self.failures += 1
+                self._backoff = min(max(self._backoff * 2, MIN_BACKOFF), MAX_BACKOFF)
+                delay = self._backoff
+                if _is_rate_limited(e):
+                    self.rate_limited += 1
+                    delay = max(_retry_after(e) or 0, delay)
+                self._retry_at = time.monotonic() + delay
+                logger.error(f"GitHub sync of {len(files)} file(s) failed, retrying in {delay:.0f}s: {str(e)}")
+                return False
+            self._backoff = 0
+            self.commits += 1
+            self.files_synced += len(files)
+            logger.info(f"Synced {len(files)} file(s) to GitHub in one commit")
+            return True
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if time.monotonic() < self._retry_at:
+                continue
+            if self._urgent:
+                # Let a burst of order changes go out in one commit
+                time.sleep(self.urgent_delay)
+            with self._lock:
+                self._urgent = False
+            self.flush()
+
+    def shutdown(self):
+        """Last flush on the way out, ignoring any backoff"""
+        if self._dirty:
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._dirty)
+        return {
+            "pending_files": pending,
+            "commits": self.commits,
+            "files_synced": self.files_synced,
+            "coalesced_writes": self.coalesced,
+            "failures": self.failures,
+            "rate_limited": self.rate_limited,
+            "backing_off": time.monotonic() < self._retry_at,
+        }
+
+github_sync = GitHubSync()
+atexit.register(github_sync.shutdown)
@@ -0,0 +1,172 @@
+import os
+import hashlib
+import logging
+import threading
+import cv2
+import numpy as np
+from image_loader import load_image
+
+logger = logging.getLogger(__name__)
+
+FEATURE_DIR = os.getenv("IMAGE_FEATURE_DIR", "image_features")
+IMAGE_SIZE = (250, 250)
+HASH_SIZE = 8  # 8x8 DCT block -> 64-bit perceptual hash
+HIST_BINS = (8, 4, 4)  # hue, saturation, value
+FEATURE_KEYS = ("gray", "descriptors", "phash", "hist")
+
+def preprocess(image):
+    """Grayscale, resize, blur and Otsu-threshold an RGB(A) array, the form every matcher compares"""
+    if image.ndim == 2:
+        gray = image
+    else:
+        gray = cv2.cvtColor(image[:, :, :3], cv2.COLOR_BGR2GRAY)
+    gray = cv2.resize(gray, IMAGE_SIZE)
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, gray = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return gray
+
+def orb_descriptors(gray):
+    descriptors = cv2.ORB_create().detectAndCompute(gray, None)[1]
+    return descriptors if descriptors is not None else np.empty((0, 32), dtype=np.uint8)
+
+def _to_rgb(image):
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    return np.ascontiguousarray(image[:, :, :3])
+
+def perceptual_hash(rgb):
+    """64-bit DCT hash as a 0/1 uint8 vector; robust to rescaling, recompression and small crops"""
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (HASH_SIZE * 4, HASH_SIZE * 4), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:HASH_SIZE, :HASH_SIZE].flatten()
+    return (low > np.median(low)).astype(np.uint8)
+
+def color_histogram(rgb):
+    """L1-normalized HSV histogram, flattened"""
+    hsv = cv2.cvtColor(cv2.resize(rgb, (64, 64), interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, list(HIST_BINS), [0, 180, 0, 256, 0, 256]).flatten()
+    return (hist / max(hist.sum(), 1.0)).astype(np.float32)
+
+def compute_features(image):
+    """Features of one image array: preprocessed grayscale, ORB descriptors, perceptual hash and colour histogram"""
+    gray = preprocess(image)
+    rgb = _to_rgb(image)
+    return {
+        "gray": gray,
+        "descriptors": orb_descriptors(gray),
+        "phash": perceptual_hash(rgb),
+        "hist": color_histogram(rgb),
+    }
+
+class ImageFeatureStore:
+    """Per product image features, computed once and kept in memory and in an npz file per image URL"""
+
+    def __init__(self, cache_dir=FEATURE_DIR, loader=load_image):
+        self.cache_dir = cache_dir
+        self.loader = loader
+        self._features = {}
+        self._lock = threading.Lock()
+        self._warming = None
+        self.version = 0  # bumped whenever the set of cached features changes
+        self.computed = 0
+        self.loaded = 0
+        self.failed = 0
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".npz")
+
+    def _load(self, url):
+        path = self._path(url)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                features = {name: data[name] for name in data.files}
+            if not all(key in features for key in FEATURE_KEYS):
+                return None  # written by an older version; recompute
+            self.loaded += 1
+            return features
+        except Exception as e:
+            logger.error(f"Discarding unreadable feature cache {path}: {str(e)}")
+            os.remove(path)
+            return None
+
+    def _compute(self, url):
+        try:
+            features = compute_features(self.loader(url))
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error processing product image {url}: {str(e)}")
+            return None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write then rename so a crash never leaves a half-written cache file behind
+        path = self._path(url)
+        # Worker processes may compute the same image; each writes its own temporary file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(tmp_path, **features)
+        os.replace(tmp_path, path)
+        self.computed += 1
+        return features
+
+    def get(self, url):
+        """Features for a product image URL, from memory, disk, or computed on the spot; None on failure"""
+        with self._lock:
+            features = self._features.get(url)
+        if features is not None:
+            return features
+        features = self._load(url) or self._compute(url)
+        if features is not None:
+            with self._lock:
+                self._features[url] = features
+                self.version += 1
+        return features
+
+    def get_many(self, urls):
+        """[(url, features)] for the URLs whose features are available"""
+        return [(url, features) for url, features in ((url, self.get(url)) for url in urls) if features is not None]
+
+    def invalidate(self, url):
+        """Forget an image, e.g. because the product changed; the next get recomputes it"""
+        if not url:
+            return
+        with self._lock:
+            if self._features.pop(url, None) is not None:
+                self.version += 1
+        path = self._path(url)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def sync(self, urls):
+        """Drop features of images no longer in the catalog and compute the missing ones in the background"""
+        urls = [url for url in dict.fromkeys(urls) if url]
+        wanted = set(urls)
+        with self._lock:
+            for url in [url for url in self._features if url not in wanted]:
+                del self._features[url]
+                self.version += 1
+        if os.path.isdir(self.cache_dir):
+            wanted_files = {os.path.basename(self._path(url)) for url in wanted}
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".npz") and ".tmp" not in name and name not in wanted_files:
+                    os.remove(os.path.join(self.cache_dir, name))
+        return self.warm(urls)
+
+    def warm(self, urls):
+        """Load or compute features for every URL in a background thread"""
+        thread = threading.Thread(target=self.get_many, args=(list(urls),), daemon=True)
+        thread.start()
+        self._warming = thread
+        return thread
+
+    def stats(self):
+        with self._lock:
+            cached = len(self._features)
+        return {
+            "cached": cached,
+            "computed": self.computed,
+            "loaded_from_disk": self.loaded,
+            "failed": self.failed,
+            "warming": bool(self._warming and self._warming.is_alive()),
+        }
+
+feature_store = ImageFeatureStore()
@@ -0,0 +1,189 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from image_features import ImageFeatureStore, compute_features
+from image_loader import decode_image
+from image_search import SignatureIndex
+from image_matcher import MatchResult, match_batch
+from image_result_cache import find_near_duplicate
+
+logger = logging.getLogger(__name__)
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(2, os.cpu_count() or 1))))
+IMAGE_MAX_PENDING = int(os.getenv("IMAGE_MAX_PENDING", "16"))  # queued + running photo jobs
+IMAGE_JOB_TIMEOUT = float(os.getenv("IMAGE_JOB_TIMEOUT", "30"))  # seconds until the customer gets a fallback reply
+
+class ImageQueueFull(Exception):
+    pass
+
+class ImageJobTimeout(Exception):
+    pass
+
+# Per worker process: the catalog index and a feature store that reads what the main process cached to disk
+_worker_state = None
+
+def _match_job(images, catalog_urls, catalog_key, near_duplicates=None, config=None):
+    """Runs in a worker process: match downloaded customer images; [(MatchResult, timings, catalog_size, phash)]"""
+    global _worker_state
+    if _worker_state is None or _worker_state[0] != catalog_key:
+        # A fresh store so features of edited products are re-read from disk, not taken from a stale copy
+        store = ImageFeatureStore()
+        _worker_state = (catalog_key, store, SignatureIndex(store.get_many(catalog_urls)))
+    _, store, index = _worker_state
+
+    queries = []
+    timings = []
+    for data in images:
+        started = time.perf_counter()
+        try:
+            queries.append(compute_features(decode_image(data)))
+        except Exception as e:
+            logger.error(f"Error in image analysis: {str(e)}")
+            queries.append(None)
+        timings.append({"features": time.perf_counter() - started})
+
+    # A near-identical photo matched before gets the same answer without the SSIM/ORB stages
+    reused = [
+        find_near_duplicate(q["phash"], near_duplicates) if q is not None else None
+        for q in queries
+    ]
+    fresh = iter(match_batch([q for q, hit in zip(queries, reused) if hit is None], index, store.get, config))
+    outcomes = []
+    for query, hit, extra in zip(queries, reused, timings):
+        result = MatchResult(*hit, near_duplicate=True) if hit else next(fresh)
+        outcomes.append((result, extra, len(index), query["phash"] if query is not None else None))
+    return outcomes
+
+def _settle(future, result=None, error=None):
+    # The timeout timer and the job itself race to settle the future; the first one wins
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+class ImageJobQueue:
+    """Process pool for photo matching, kept apart from the text path, with a cap on pending jobs"""
+
+    def __init__(self, workers=IMAGE_WORKERS, max_pending=IMAGE_MAX_PENDING, timeout=IMAGE_JOB_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.failed = 0
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # fork keeps workers from re-running the web app's module-level setup
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("fork" if "fork" in methods else None)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+    def _reset_pool(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def _recycle(self, pool):
+        """Kill a pool whose job overran the timeout; the slots of its jobs come back as they fail"""
+        processes = list((getattr(pool, "_processes", None) or {}).values())
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+        logger.warning(f"Recycled the image worker pool after a job overran {self.timeout}s")
+
+    def reserve(self):
+        """Claim a pending slot before the photos are downloaded; raises ImageQueueFull when none is free"""
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise ImageQueueFull("Too many photos are being checked")
+
+    def release(self):
+        """Give back a reserved slot that never reached submit()"""
+        self._slots.release()
+
+    def with_deadline(self, inner, on_expire=None):
+        """A Future that follows inner but fails with ImageJobTimeout after the timeout, calling on_expire() if inner is still running"""
+        future = Future()
+
+        def expire():
+            if not future.done():
+                self.timed_out += 1
+            _settle(future, error=ImageJobTimeout(f"Photo matching took longer than {self.timeout}s"))
+            if on_expire and not inner.done():
+                on_expire()
+
+        timer = threading.Timer(self.timeout, expire)
+        timer.daemon = True
+        timer.start()
+
+        def finished(inner):
+            timer.cancel()
+            try:
+                _settle(future, inner.result())
+            except Exception as e:
+                _settle(future, error=e)
+
+        inner.add_done_callback(finished)
+        return future
+
+    def submit(self, images, catalog_urls, catalog_key, near_duplicates=None, config=None, reserved=False):
+        """Queue downloaded images; a Future of _match_job's result that fails after the timeout. reserved=True uses the slot from reserve()"""
+        if not reserved:
+            self.reserve()
+        pool = self._get_pool()
+        try:
+            job = pool.submit(_match_job, list(images), list(catalog_urls), catalog_key, near_duplicates, config)
+        except Exception:
+            self._slots.release()
+            self._reset_pool(pool)
+            raise
+        self.submitted += 1
+
+        def finished(job):
+            # The slot is only freed when the worker is really done, so slow jobs still count against the cap
+            self._slots.release()
+            try:
+                job.result()
+            except BrokenProcessPool:
+                self.failed += 1
+                self._reset_pool(pool)
+            except Exception:
+                self.failed += 1
+
+        job.add_done_callback(finished)
+        # A hung worker would keep its slot and process forever; replace the pool so capacity comes back
+        return self.with_deadline(job, on_expire=lambda: self._recycle(pool))
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "failed": self.failed,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+image_jobs = ImageJobQueue()
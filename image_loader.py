@@ -0,0 +1,61 @@
+import os
+import time
+from io import BytesIO
+import requests
+import numpy as np
+from PIL import Image
+
+MAX_IMAGE_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(8 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = 40_000_000  # refuse decompression bombs before decoding
+CONNECT_TIMEOUT = 5  # seconds
+READ_TIMEOUT = 10  # seconds between bytes
+DOWNLOAD_DEADLINE = 20  # seconds for the whole body, so a slow-dripping host can't hold a worker
+CHUNK_SIZE = 64 * 1024
+DECODE_SIZE = (250, 250)  # the largest size any matcher stage uses
+
+class ImageTooLarge(Exception):
+    pass
+
+def fetch_image_bytes(url, max_bytes=MAX_IMAGE_BYTES, deadline=DOWNLOAD_DEADLINE):
+    """Stream an image with connect/read timeouts, giving up past max_bytes or the overall deadline"""
+    started = time.monotonic()
+    with requests.get(url, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as response:
+        response.raise_for_status()
+        declared = response.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            raise ImageTooLarge(f"{url} is {declared} bytes, limit is {max_bytes}")
+        buffer = bytearray()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            buffer.extend(chunk)
+            if len(buffer) > max_bytes:
+                raise ImageTooLarge(f"{url} exceeds {max_bytes} bytes")
+            if time.monotonic() - started > deadline:
+                raise TimeoutError(f"Downloading {url} took longer than {deadline}s")
+        return bytes(buffer)
+
+def _flatten(image):
+    """RGB copy of any mode; transparent areas become white instead of the black they'd be in a plain convert"""
+    if image.mode == "P":
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    if image.mode in ("RGBA", "LA"):
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB") if image.mode != "RGB" else image
+
+def decode_image(data, size=DECODE_SIZE):
+    """Decode straight to roughly the target size: JPEG via draft mode, other formats via reduce"""
+    image = Image.open(BytesIO(data))
+    if image.width * image.height > MAX_IMAGE_PIXELS:
+        raise ImageTooLarge(f"Image is {image.width}x{image.height} pixels")
+    # JPEG can decode at 1/2, 1/4 or 1/8 scale without ever holding the full-size bitmap
+    image.draft("RGB", size)
+    # reduce() only handles RGB-like modes, so palette and 1-bit images are flattened first
+    image = _flatten(image)
+    factor = min(image.width // size[0], image.height // size[1])
+    if factor >= 2:
+        image = image.reduce(factor)
+    return np.array(image)
+
+def load_image(url, size=DECODE_SIZE):
+    return decode_image(fetch_image_bytes(url), size)
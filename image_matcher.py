@@ -0,0 +1,142 @@
+import os
+import time
+import threading
+import cv2
+from skimage.metrics import structural_similarity as ssim
+
+# Import-safe: no downloads, globals or catalog access, so worker processes can use it too
+
+SHORTLIST_SIZE = int(os.getenv("IMAGE_SHORTLIST_SIZE", "10"))  # candidates kept by the signature prefilter
+PREFILTER_MARGIN = float(os.getenv("IMAGE_PREFILTER_MARGIN", "0.2"))  # drop candidates this far behind the best signature score
+MATCH_THRESHOLD = float(os.getenv("IMAGE_MATCH_THRESHOLD", "0.4"))
+EARLY_EXIT_SCORE = float(os.getenv("IMAGE_EARLY_EXIT_SCORE", "0.8"))  # stop at a candidate this good
+DOMINANCE_MARGIN = float(os.getenv("IMAGE_DOMINANCE_MARGIN", "0.15"))  # signature lead that makes the top candidate decisive
+SSIM_WEIGHT = 0.7
+ORB_WEIGHT = 0.3
+
+class CascadeConfig:
+    def __init__(self, shortlist_size=SHORTLIST_SIZE, prefilter_margin=PREFILTER_MARGIN,
+                 match_threshold=MATCH_THRESHOLD, early_exit_score=EARLY_EXIT_SCORE,
+                 dominance_margin=DOMINANCE_MARGIN, ssim_weight=SSIM_WEIGHT, orb_weight=ORB_WEIGHT):
+        self.shortlist_size = shortlist_size
+        self.prefilter_margin = prefilter_margin
+        self.match_threshold = match_threshold
+        self.early_exit_score = early_exit_score
+        self.dominance_margin = dominance_margin
+        self.ssim_weight = ssim_weight
+        self.orb_weight = orb_weight
+
+def orb_score(des1, des2, bf):
+    if not len(des1) or not len(des2):
+        return 0
+    matches = bf.match(des1, des2)
+    return len(matches) / max(len(des1), len(des2)) if matches else 0
+
+class MatchResult:
+    def __init__(self, key=None, score=0, timings=None, compared=0, early_exit=False, near_duplicate=False):
+        self.key = key
+        self.score = score
+        self.timings = timings or {}  # stage -> seconds
+        self.compared = compared  # candidates that reached SSIM
+        self.early_exit = early_exit
+        self.near_duplicate = near_duplicate  # reused the result of a near-identical earlier photo
+
+def shortlist(ranked, config):
+    """Prefilter stage: the top signature candidates, minus those far behind the leader"""
+    if not ranked:
+        return []
+    best = ranked[0][1]
+    return [(key, score) for key, score in ranked[:config.shortlist_size] if score >= best - config.prefilter_margin]
+
+def refine(query, candidates, features_for, config, bf=None):
+    """SSIM/ORB stage over the shortlist, in signature order, stopping as soon as the answer is clear"""
+    bf = bf or cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    result = MatchResult()
+    ssim_time = orb_time = 0.0
+    # When the top signature clearly beats the rest, the rest only matters if the top one fails
+    dominant = len(candidates) == 1 or (
+        len(candidates) > 1 and candidates[0][1] - candidates[1][1] >= config.dominance_margin
+    )
+
+    for position, (key, _) in enumerate(candidates):
+        features = features_for(key)
+        if features is None:
+            continue
+        started = time.perf_counter()
+        ssim_score = ssim(query["gray"], features["gray"])
+        ssim_time += time.perf_counter() - started
+        result.compared += 1
+
+        # ORB can add at most orb_weight; skip it when even a perfect ORB score couldn't win
+        ceiling = config.ssim_weight * ssim_score + config.orb_weight
+        if ceiling <= max(result.score, config.match_threshold):
+            continue
+        started = time.perf_counter()
+        score = config.ssim_weight * ssim_score + config.orb_weight * orb_score(query["descriptors"], features["descriptors"], bf)
+        orb_time += time.perf_counter() - started
+
+        if score > result.score:
+            result.key, result.score = key, score
+        if result.score >= config.early_exit_score or (position == 0 and dominant and result.score > config.match_threshold):
+            result.early_exit = position < len(candidates) - 1
+            break
+
+    result.timings = {"ssim": ssim_time, "orb": orb_time}
+    if result.score <= config.match_threshold:
+        result.key, result.score = None, 0
+    return result
+
+def match_batch(queries, index, features_for, config=None):
+    """Cascade for several query images: one batched signature pass, then refine each shortlist"""
+    config = config or CascadeConfig()
+    started = time.perf_counter()
+    valid = [q for q in queries if q is not None]
+    ranked = iter(index.top_k(valid, config.shortlist_size))
+    prefilter_time = (time.perf_counter() - started) / max(len(valid), 1)
+
+    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    results = []
+    for query in queries:
+        if query is None:
+            results.append(MatchResult())
+            continue
+        result = refine(query, shortlist(next(ranked), config), features_for, config, bf)
+        result.timings["prefilter"] = prefilter_time
+        results.append(result)
+    return results
+
+class CascadeStats:
+    """Running per-stage timings and comparison counts, for the usage page"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.matched = 0
+        self.early_exits = 0
+        self.compared = 0
+        self.catalog_size = 0
+        self.stage_seconds = {"download": 0.0, "features": 0.0, "prefilter": 0.0, "ssim": 0.0, "orb": 0.0}
+
+    def record(self, result, catalog_size, extra_timings=None):
+        with self._lock:
+            self.queries += 1
+            self.matched += result.key is not None
+            self.early_exits += result.early_exit
+            self.compared += result.compared
+            self.catalog_size = catalog_size
+            for stage, seconds in {**result.timings, **(extra_timings or {})}.items():
+                self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    def stats(self):
+        with self._lock:
+            queries = self.queries or 1
+            return {
+                "queries": self.queries,
+                "matched": self.matched,
+                "early_exits": self.early_exits,
+                "catalog_size": self.catalog_size,
+                "avg_detailed_comparisons": round(self.compared / queries, 2),
+                "avg_stage_ms": {stage: round(seconds * 1000 / queries, 1) for stage, seconds in self.stage_seconds.items()},
+            }
+
+cascade_stats = CascadeStats()
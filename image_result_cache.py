@@ -0,0 +1,77 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+MAX_ENTRIES = int(os.getenv("IMAGE_RESULT_CACHE_SIZE", "1000"))
+NEAR_DUPLICATE_BITS = int(os.getenv("IMAGE_NEAR_DUPLICATE_BITS", "4"))  # of 64 perceptual hash bits
+
+def find_near_duplicate(phash, near_duplicates, max_bits=NEAR_DUPLICATE_BITS):
+    """(key, score) of a cached photo whose perceptual hash is within max_bits of phash, else None"""
+    if near_duplicates is None:
+        return None
+    hashes, results = near_duplicates
+    distances = np.count_nonzero(hashes != phash, axis=1)
+    best = int(np.argmin(distances))
+    return results[best] if distances[best] <= max_bits else None
+
+class ImageResultCache:
+    """LRU of match results for customer photos, by content hash, with a perceptual hash for near duplicates"""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # sha256 -> (phash, key, score)
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def _check_version(self, version):
+        # A catalog change can change any photo's best match
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, digest, version):
+        """(key, score) for a byte-identical photo seen before, else None"""
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def near_duplicates(self, version):
+        """Hashes and results of every cached photo, for the image workers; None if there are none"""
+        with self._lock:
+            self._check_version(version)
+            if not self._entries:
+                return None
+            entries = list(self._entries.values())
+        return np.stack([e[0] for e in entries]), [(e[1], e[2]) for e in entries]
+
+    def put(self, digest, phash, key, score, version, near_duplicate=False):
+        with self._lock:
+            if version != self._version:
+                return  # the catalog changed while this photo was being matched
+            if near_duplicate:
+                self.near_hits += 1
+            self._entries[digest] = (np.asarray(phash, dtype=np.uint8), key, score)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "near_duplicate_hits": self.near_hits,
+                "misses": self.misses,
+            }
+
+image_result_cache = ImageResultCache()
@@ -0,0 +1,50 @@
+import numpy as np
+
+HASH_WEIGHT = 0.5
+HIST_WEIGHT = 0.5
+
+class SignatureIndex:
+    """Perceptual hashes and colour histograms of every product image as two matrices, scored in one batch"""
+
+    def __init__(self, entries, hash_weight=HASH_WEIGHT, hist_weight=HIST_WEIGHT):
+        """entries: [(key, features)] where features carry "phash" and "hist" """
+        self.keys = [key for key, _ in entries]
+        self.hash_weight = hash_weight
+        self.hist_weight = hist_weight
+        if entries:
+            # Hashes as ±1 so Hamming distance comes out of a single matrix product
+            self._hashes = np.stack([f["phash"] for _, f in entries]).astype(np.float32) * 2 - 1
+            # Square roots so the Bhattacharyya coefficient is a dot product too
+            self._hists = np.sqrt(np.stack([f["hist"] for _, f in entries]).astype(np.float32))
+        else:
+            self._hashes = np.empty((0, 0), dtype=np.float32)
+            self._hists = np.empty((0, 0), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def scores(self, queries):
+        """(len(queries), len(self)) similarity matrix in [0, 1] for a list of query features"""
+        if not queries or not self.keys:
+            return np.zeros((len(queries), len(self.keys)), dtype=np.float32)
+        hashes = np.stack([q["phash"] for q in queries]).astype(np.float32) * 2 - 1
+        hists = np.sqrt(np.stack([q["hist"] for q in queries]).astype(np.float32))
+        bits = self._hashes.shape[1]
+        # dot of ±1 vectors = bits - 2 * hamming, so similarity = (dot + bits) / (2 * bits)
+        hash_similarity = (hashes @ self._hashes.T + bits) / (2 * bits)
+        hist_similarity = np.clip(hists @ self._hists.T, 0.0, 1.0)
+        return self.hash_weight * hash_similarity + self.hist_weight * hist_similarity
+
+    def top_k(self, queries, k=5):
+        """For each query, [(key, score)] of the k most similar images, best first"""
+        scores = self.scores(queries)
+        k = min(k, len(self.keys))
+        results = []
+        for row in scores:
+            if k == 0:
+                results.append([])
+                continue
+            best = np.argpartition(-row, k - 1)[:k]
+            best = best[np.argsort(-row[best])]
+            results.append([(self.keys[i], float(row[i])) for i in best])
+        return results
@@ -0,0 +1,187 @@
+import re
+import threading
+from collections import Counter
+from catalog_index import STOPWORDS, tokenize
+from response_cache import is_cacheable_message
+
+MAX_WORDS = 12  # longer messages usually need the LLM
+
+# Keyword sets per intent, English/Banglish and Bangla
+INTENT_KEYWORDS = {
+    "delivery_charge": (
+        "delivery charge", "delivery cost", "delivery fee", "shipping charge", "shipping cost",
+        "delivery koto", "charge koto", "ডেলিভারি চার্জ", "ডেলিভারি খরচ", "চার্জ কত",
+    ),
+    "delivery_time": (
+        "delivery time", "how many days", "how long", "koto din", "kotodin", "kobe pabo",
+        "কত দিন", "কতদিন", "কবে পাব",
+    ),
+    "payment": (
+        "payment", "cod", "cash on delivery", "bkash", "nagad", "paypal", "how can i pay", "how to pay",
+        "পেমেন্ট", "ক্যাশ অন ডেলিভারি", "বিকাশ", "নগদ",
+    ),
+    "price": ("price", "cost", "how much", "dam", "daam", "koto taka", "দাম", "কত টাকা"),
+    "sizes": ("size", "sizes", "সাইজ"),
+    "colors": ("color", "colour", "colors", "colours", "kalar", "কালার", "রং", "রঙ"),
+}
+PRODUCT_INTENTS = {"price", "sizes", "colors"}
+# Words that add a second question ("... with delivery to Chittagong") unless the matched keyword already covers them
+CLAUSE_WORDS = {
+    "and", "with", "plus", "including", "also", "delivery", "shipping", "ar", "soho", "shoho",
+    "এবং", "আর", "সহ", "ডেলিভারি",
+}
+DELIVERY_WORDS = {"delivery", "shipping", "ডেলিভারি"}  # not a new topic in a delivery question
+# Greetings and question fillers that don't change what is being asked
+FILLER_WORDS = {
+    "about", "tell", "know", "need", "get", "will", "be", "this", "that", "these", "there", "here", "take", "takes",
+    "hi", "hello", "sir", "pls", "plz", "koto", "kto", "ki", "ache", "ase", "achhe", "er", "ta", "ti", "eta", "ei",
+    "oi", "bhai", "vai", "apu", "jante", "chai", "bolben", "bolen",
+    "কত", "কি", "কী", "আছে", "এর", "টা", "টি", "ভাই", "আপু", "জানতে", "চাই", "বলুন", "বলেন", "একটু",
+}
+
+_bangla_re = re.compile(r"[ঀ-৿]")
+
+TEMPLATES = {
+    "en": {
+        "delivery_charge": "Delivery charges:\n{delivery_charges}",
+        "delivery_time": "Delivery times:\n{delivery_times}",
+        "payment": "We accept: {payment_methods}.",
+        "price_line": "{type} ({category}): {price}{currency}",
+        "sizes_line": "{type} sizes: {sizes}",
+        "colors_line": "{type} colors: {colors}",
+    },
+    "bn": {
+        "delivery_charge": "ডেলিভারি চার্জ:\n{delivery_charges}",
+        "delivery_time": "ডেলিভারি সময়:\n{delivery_times}",
+        "payment": "আমরা পেমেন্ট নিই: {payment_methods}।",
+        "price_line": "{type} ({category}) এর দাম {price}{currency}",
+        "sizes_line": "{type} এর সাইজ: {sizes}",
+        "colors_line": "{type} এর কালার: {colors}",
+    },
+}
+
+_word_re = re.compile(r"\w+", re.UNICODE)
+_clause_word_re = re.compile(r"[\w\u0980-\u09FF]+")  # keeps Bangla vowel signs inside the word
+
+def detect_intents(message):
+    lowered = str(message).lower()
+    words = f" {' '.join(_word_re.findall(lowered))} "
+    found = []
+    for intent, keywords in INTENT_KEYWORDS.items():
+        # Latin keywords must match whole words so "cod" doesn't match "code"
+        if any((f" {k} " in words) if k.isascii() else (k in lowered) for k in keywords):
+            found.append(intent)
+    # Delivery charge questions often also say "koto" or "how much"; the price intent is then redundant
+    if "delivery_charge" in found and "price" in found:
+        found.remove("price")
+    return found
+
+def _stem(word):
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+def unexplained_words(message, intent, matched=()):
+    """Words the intent's keywords and the matched products don't account for, e.g. "cancel" or a quantity"""
+    text = str(message).lower()
+    for keyword in sorted(INTENT_KEYWORDS[intent], key=len, reverse=True):
+        text = re.sub(rf"(?<!\w){re.escape(keyword)}(?!\w)" if keyword.isascii() else re.escape(keyword), " ", text)
+    # "and", "with" and the like stay unexplained: they join a second question
+    explained = (STOPWORDS | FILLER_WORDS) - CLAUSE_WORDS
+    if intent.startswith("delivery"):
+        explained |= DELIVERY_WORDS
+    for product in matched:
+        explained |= set(tokenize(f"{product.get('type', '')} {product.get('category', '')}"))
+    return [word for word in _clause_word_re.findall(text) if word not in explained and _stem(word) not in explained]
+
+def match_products(message, products):
+    """Products whose full type name appears in the message, else every product of a mentioned category"""
+    words = set(tokenize(message))
+    by_type = [p for p in products if set(tokenize(p.get("type", ""))) <= words and tokenize(p.get("type", ""))]
+    if by_type:
+        return by_type
+    return [p for p in products if set(tokenize(p.get("category", ""))) & words]
+
+def _payment_methods(settings):
+    methods = settings["payment_methods"]
+    enabled = []
+    if methods.get("cod"):
+        enabled.append("Cash on Delivery")
+    if methods.get("bkash"):
+        enabled.append(f"Bkash ({methods.get('bkash_number')} - {methods.get('bkash_type')})")
+    if methods.get("nagad"):
+        enabled.append(f"Nagad ({methods.get('nagad_number')} - {methods.get('nagad_type')})")
+    if methods.get("paypal"):
+        enabled.append(f"PayPal ({methods.get('paypal_email')})")
+    return ", ".join(enabled)
+
+class IntentRouter:
+    """Answers simple catalog, delivery and payment lookups from templates without calling the LLM"""
+
+    def __init__(self):
+        self.routed = Counter()
+        self.fell_through = 0
+        self._lock = threading.Lock()
+
+    def route(self, message, history, products, settings):
+        """Return a templated reply, or None when the LLM should answer"""
+        reply, intent = self._answer(message, history, products, settings)
+        with self._lock:
+            if reply:
+                self.routed[intent] += 1
+            else:
+                self.fell_through += 1
+        return reply
+
+    def _answer(self, message, history, products, settings):
+        if not is_cacheable_message(message, history) or len(message.split()) > MAX_WORDS:
+            return None, None
+        intents = detect_intents(message)
+        if len(intents) != 1:
+            return None, None
+        intent = intents[0]
+        matches = match_products(message, products) if intent in PRODUCT_INTENTS else []
+        # Anything the template wouldn't answer (a second question, a quantity, a cancellation) needs the LLM
+        if unexplained_words(message, intent, matches):
+            return None, None
+        templates = TEMPLATES["bn" if _bangla_re.search(message) else "en"]
+        currency = settings["currency"]
+
+        if intent in PRODUCT_INTENTS:
+            # A whole category is fine for prices, but sizes and colours need one specific product
+            if not matches or (intent != "price" and len(matches) != 1):
+                return None, None
+            lines = [
+                templates[f"{intent}_line"].format(
+                    type=p["type"], category=p["category"], price=p["price"], currency=currency,
+                    sizes=", ".join(map(str, p["size"])), colors=", ".join(p["color"]),
+                )
+                for p in matches
+            ]
+            return "\n".join(lines), intent
+
+        records = settings["delivery_records"]
+        if intent == "payment":
+            methods = _payment_methods(settings)
+            return (templates[intent].format(payment_methods=methods), intent) if methods else (None, None)
+        if not records:
+            return None, None
+        return templates[intent].format(
+            delivery_charges="\n".join(
+                f"- {r['region'].strip()}, {r['country'].strip()}: {r['delivery_charge']}{currency}" for r in records
+            ),
+            delivery_times="\n".join(
+                f"- {r['region'].strip()}, {r['country'].strip()}: {r['delivery_time']}" for r in records
+            ),
+        ), intent
+
+    def stats(self):
+        with self._lock:
+            routed = sum(self.routed.values())
+            total = routed + self.fell_through
+            return {
+                "routed": routed,
+                "fell_through": self.fell_through,
+                "routed_rate": round(routed / total, 3) if total else 0.0,
+                "by_intent": dict(self.routed),
+            }
+
+intent_router = IntentRouter()
@@ -0,0 +1,210 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import weakref
+import threading
+import requests
+import async_http
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+KEY_MANAGER_URL = 'https://ezbo.org/api/key-manager.php/123456'
+KEY_REPORT_URL = 'https://ezbo.org/api/key-manager.php?action=report_error&key={key}'
+
+POOL_SIZE = int(os.getenv("GEMINI_KEY_POOL_SIZE", "4"))
+KEY_TTL = int(os.getenv("GEMINI_KEY_TTL", "600"))  # seconds before the pool is refreshed
+ERROR_THRESHOLD = 2  # consecutive errors before a key is benched
+COOLDOWN = 60  # seconds a benched key stays out of rotation
+REQUEST_TIMEOUT = (3, 5)  # (connect, read) seconds
+
+class _KeyState:
+    def __init__(self, key):
+        self.key = key
+        self.errors = 0
+        self.successes = 0
+        self.benched_until = 0.0
+
+    def available(self, now):
+        return self.benched_until <= now
+
+class KeyPool:
+    """Cached, round-robin pool of Gemini API keys from the key manager"""
+
+    def __init__(self, size=POOL_SIZE, ttl=KEY_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._keys = []
+        self._cursor = 0
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._reports = queue.Queue()
+        self._worker = None
+        self._rotation_listeners = []
+        self._async_locks = weakref.WeakKeyDictionary()
+
+    def add_rotation_listener(self, listener):
+        """Call listener(key) whenever a key drops out of the pool"""
+        self._rotation_listeners.append(listener)
+
+    def _fetch_key(self):
+        response = requests.get(KEY_MANAGER_URL, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json()['api_key']
+
+    def refresh(self):
+        """Fetch a fresh batch of keys, keeping the health of keys we already know"""
+        with self._refresh_lock:
+            self._refresh()
+
+    def _refresh(self):
+        fetched = []
+        for _ in range(self.size):
+            try:
+                key = self._fetch_key()
+            except Exception as e:
+                logger.error(f"Error fetching API key: {str(e)}")
+                break
+            if key and key not in fetched:
+                fetched.append(key)
+
+        self._install(fetched)
+
+    def _install(self, fetched):
+        with self._lock:
+            if not fetched:
+                # Keep serving the stale keys rather than failing every message
+                if self._keys:
+                    self._fetched_at = time.monotonic()
+                    return
+                raise RuntimeError("Failed to fetch Gemini API key from key manager")
+            known = {state.key: state for state in self._keys}
+            self._keys = [known.get(key) or _KeyState(key) for key in fetched]
+            self._cursor = 0
+            self._fetched_at = time.monotonic()
+        logger.info(f"Gemini key pool refreshed with {len(fetched)} key(s)")
+
+        for key in set(known) - set(fetched):
+            for listener in self._rotation_listeners:
+                try:
+                    listener(key)
+                except Exception as e:
+                    logger.error(f"Key rotation listener failed: {str(e)}")
+
+    async def refresh_async(self):
+        """Same as refresh() but fetches the batch concurrently without blocking the event loop"""
+        results = await asyncio.gather(
+            *(async_http.fetch_json(KEY_MANAGER_URL) for _ in range(self.size)),
+            return_exceptions=True
+        )
+        fetched = []
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Error fetching API key: {str(result)}")
+                continue
+            key = result.get('api_key')
+            if key and key not in fetched:
+                fetched.append(key)
+        self._install(fetched)
+
+    def _expired(self):
+        return not self._keys or time.monotonic() - self._fetched_at > self.ttl
+
+    def get_key(self):
+        """Return the next healthy key, refreshing the pool when its TTL has passed"""
+        if self._expired():
+            with self._refresh_lock:
+                # Only the first waiting thread refreshes; the rest reuse its keys
+                if self._expired():
+                    self._refresh()
+        return self._next_key()
+
+    async def get_key_async(self):
+        if self._expired():
+            loop = asyncio.get_running_loop()
+            lock = self._async_locks.setdefault(loop, asyncio.Lock())
+            async with lock:
+                # Only the first waiting coroutine refreshes; the rest reuse its keys
+                if self._expired():
+                    await self.refresh_async()
+        return self._next_key()
+
+    def _next_key(self):
+        with self._lock:
+            now = time.monotonic()
+            count = len(self._keys)
+            for offset in range(count):
+                state = self._keys[(self._cursor + offset) % count]
+                if state.available(now):
+                    self._cursor = (self._cursor + offset + 1) % count
+                    return state.key
+            # Every key is benched: hand out the one that comes back soonest
+            state = min(self._keys, key=lambda s: s.benched_until)
+            return state.key
+
+    def report_success(self, key):
+        with self._lock:
+            for state in self._keys:
+                if state.key == key:
+                    state.errors = 0
+                    state.successes += 1
+                    break
+
+    def report_error(self, key):
+        """Bench a key after repeated errors and report it to the key manager in the background"""
+        with self._lock:
+            for state in self._keys:
+                if state.key == key:
+                    state.errors += 1
+                    if state.errors >= ERROR_THRESHOLD:
+                        # Back off longer for keys that keep failing
+                        state.benched_until = time.monotonic() + COOLDOWN * (state.errors - ERROR_THRESHOLD + 1)
+                        logger.warning(f"Gemini key benched after {state.errors} consecutive errors")
+                    break
+        self._ensure_worker()
+        self._reports.put(key)
+
+    def _ensure_worker(self):
+        if self._worker and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._report_loop, name="key-error-reporter", daemon=True)
+            self._worker.start()
+
+    def _report_loop(self):
+        while True:
+            key = self._reports.get()
+            try:
+                requests.get(KEY_REPORT_URL.format(key=key), timeout=REQUEST_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Failed to report key error: {str(e)}")
+            finally:
+                self._reports.task_done()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "key": f"...{state.key[-4:]}",
+                    "errors": state.errors,
+                    "successes": state.successes,
+                    "available": state.available(now),
+                }
+                for state in self._keys
+            ]
+
+key_pool = KeyPool()
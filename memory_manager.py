@@ -1,7 +1,8 @@
 import os
 import json
+import threading
 from datetime import datetime
-from github import Github
+from github_sync import github_sync
 from dotenv import load_dotenv
 import logging
 
@@ -18,6 +19,9 @@ logger = logging.getLogger(__name__)
 MEMORY_DIR = "chatsmemory"
 MAX_MESSAGES = 30
 
+# Memory files are read, changed and rewritten; the bots write from several threads at once
+_write_lock = threading.Lock()
+
 def ensure_memory_dir():
     """Ensure the memory directory exists"""
     if not os.path.exists(MEMORY_DIR):
@@ -27,34 +31,38 @@ def get_memory_filename(platform, user_id):
     """Generate memory filename for a user"""
     return os.path.join(MEMORY_DIR, f"{platform}_{user_id}_chats.json")
 
-def update_user_memory(platform, user_id, message):
-    """Update user memory with a new message"""
+def update_user_memory(platform, user_id, message, role=None):
+    """Update user memory with a new message (role: user or model)"""
     ensure_memory_dir()
     filename = get_memory_filename(platform, user_id)
     
     try:
-        # Load existing messages
-        if os.path.exists(filename):
-            with open(filename, 'r') as f:
-                messages = json.load(f)
-        else:
-            messages = []
-        
-        # Add new message with timestamp
-        messages.append({
-            "timestamp": datetime.now().isoformat(),
-            "message": message
-        })
-        
-        # Keep only the last MAX_MESSAGES
-        messages = messages[-MAX_MESSAGES:]
-        
-        # Save to file
-        with open(filename, 'w') as f:
-            json.dump(messages, f, indent=2)
+        with _write_lock:
+            # Load existing messages
+            if os.path.exists(filename):
+                with open(filename, 'r') as f:
+                    messages = json.load(f)
+            else:
+                messages = []
+            
+            # Add new message with timestamp
+            record = {
+                "timestamp": datetime.now().isoformat(),
+                "message": message
+            }
+            if role:
+                record["role"] = role
+            messages.append(record)
             
-        # Update GitHub repository
-        update_github_repo(filename, messages)
+            # Keep only the last MAX_MESSAGES
+            messages = messages[-MAX_MESSAGES:]
+            
+            # Save to file
+            with open(filename, 'w') as f:
+                json.dump(messages, f, indent=2)
+            
+            # Update GitHub repository
+            update_github_repo(filename, messages)
         
     except Exception as e:
         logger.error(f"Error updating user memory: {str(e)}")
@@ -84,34 +92,65 @@ def get_conversation_history(platform, user_id):
         logger.error(f"Error reading conversation history: {str(e)}")
         return ""
 
-def update_github_repo(filename, content):
-    """Update GitHub repository with memory changes"""
+def get_conversation_turns(platform, user_id):
+    """Get conversation history for a user as [{"role": "user"|"model", "text": ..., "ts": ...}]"""
+    filename = get_memory_filename(platform, user_id)
+    
+    if not os.path.exists(filename):
+        return []
+    
     try:
-        github = Github(os.getenv("GITHUB_ACCESS_TOKEN"))
-        repo = github.get_repo(os.getenv("GITHUB_REPO_NAME"))
-        
-        # Convert content to string if it's not already
-        if not isinstance(content, str):
-            content = json.dumps(content, indent=2)
-        
-        # Try to get the file first
-        try:
-            file_content = repo.get_contents(filename)
-            repo.update_file(
-                path=filename,
-                message="Update chat memory via chatbot",
-                content=content,
-                sha=file_content.sha
-            )
-        except Exception as e:
-            if "404" in str(e):  # File doesn't exist
-                repo.create_file(
-                    path=filename,
-                    message="Initialize chat memory file",
-                    content=content,
-                    branch="main"
-                )
+        with open(filename, 'r') as f:
+            messages = json.load(f)
         
-        logger.info(f"GitHub repository updated with memory changes for {filename}")
+        turns = []
+        for msg in messages:
+            message_text = msg['message']
+            role = msg.get('role')
+            if message_text.startswith(("User:", "AI:")):
+                role = role or ("user" if message_text.startswith("User:") else "model")
+                message_text = message_text.split(":", 1)[1].strip()
+            if not role:
+                # Older records carry no role; customer and assistant messages alternate
+                role = "model" if turns and turns[-1]["role"] == "user" else "user"
+            turns.append({"role": role, "text": message_text, "ts": msg.get('timestamp')})
+        return turns
+    except Exception as e:
+        logger.error(f"Error reading conversation turns: {str(e)}")
+        return []
+
+def get_summary_filename(platform, user_id):
+    return os.path.join(MEMORY_DIR, f"{platform}_{user_id}_summary.json")
+
+def get_user_summary(platform, user_id):
+    """Get the running summary of a user's older conversation, or None"""
+    filename = get_summary_filename(platform, user_id)
+    
+    if not os.path.exists(filename):
+        return None
+    
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
     except Exception as e:
-        logger.error(f"Failed to update GitHub repository with memory changes: {str(e)}")
+        logger.error(f"Error reading conversation summary: {str(e)}")
+        return None
+
+def save_user_summary(platform, user_id, summary):
+    """Save the running summary of a user's older conversation"""
+    ensure_memory_dir()
+    filename = get_summary_filename(platform, user_id)
+    
+    try:
+        with _write_lock:
+            with open(filename, 'w') as f:
+                json.dump(summary, f, indent=2)
+            
+            # Update GitHub repository
+            update_github_repo(filename, summary)
+    except Exception as e:
+        logger.error(f"Error saving conversation summary: {str(e)}")
+
+def update_github_repo(filename, content):
+    """Queue memory changes for the next batched GitHub commit"""
+    github_sync.mark_dirty(filename, content)
@@ -1,19 +1,46 @@
 import os
+import re
+import asyncio
+import weakref
+import itertools
+import functools
 import logging
-import requests
-from io import BytesIO
 import time
-import google.generativeai as genai
 from dotenv import load_dotenv
 import urllib3
 from brain import query
+from key_pool import key_pool
+from model_registry import model_registry
+from catalog_index import CatalogIndex, format_category_summary
+from order_index import OrderIndex, is_order_lookup
+from usage_stats import usage_tracker
+from response_cache import response_cache
+from intent_router import intent_router
+from image_features import feature_store
+from image_matcher import cascade_stats
+from image_jobs import image_jobs, ImageQueueFull, ImageJobTimeout
+from image_loader import fetch_image_bytes
+from image_result_cache import image_result_cache
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from session_manager import session_manager
+from store import store
+from order_backup import ORDERS_BACKUP_PATH, encode_orders, load_orders_backup
+from analytics import analytics
+from sales_log_archive import sales_log_archive, partition_of, iter_logs, iter_legacy_logs, SINGLE_FILE_PATH
+from memory_manager import get_conversation_turns, get_user_summary, save_user_summary
+from conversation_window import ConversationSummary
+from order_parser import (
+    ORDER_PLACED, OPEN_TAG, CLOSE_TAG, OrderBlockFilter, extract_order, strip_order_block, order_deduplicator
+)
+from resilience import (
+    CircuitBreaker, CircuitOpenError, RetryPolicy, FATAL,
+    call_with_retry, call_with_retry_async, classify_error,
+)
 import datetime
-from github import Github
+import threading
+from github_sync import github_sync
 from collections import deque
-import cv2
-import numpy as np
-from PIL import Image
-from skimage.metrics import structural_similarity as ssim
 
 # Disable SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -55,6 +82,18 @@ settings = {
     "return_policy": "Customers can return products within 7 days if there is a valid issue. Money will be refunded without delivery charges."
 }
 
+# Data versions, bumped on every mutation so derived caches can tell when they are stale
+data_versions = {"catalog": 0, "orders": 0, "settings": 0}
+_version_lock = threading.Lock()
+
+def bump_version(*kinds):
+    with _version_lock:
+        for kind in kinds:
+            data_versions[kind] += 1
+
+def get_data_version(*kinds):
+    return tuple(data_versions[kind] for kind in kinds)
+
 def update_settings(shop_name=None, shop_number=None, shop_email=None, currency=None, ai_name=None, greeting=None, 
                    payment_methods=None, delivery_records=None, service_products=None, return_policy=None):
     if shop_name:
@@ -75,10 +114,16 @@ def update_settings(shop_name=None, shop_number=None, shop_email=None, currency=
         settings["service_products"] = service_products
     if return_policy:
         settings["return_policy"] = return_policy
+    store.save_settings(settings)
+    bump_version("settings")
 
 def get_settings():
     return settings
 
+# The defaults above seed the store on first run; after that the store is the source of truth
+store.import_once("settings", lambda: settings)
+settings.update(store.load_settings())
+
 def format_delivery_records():
     return "\n".join([
         f"{record['country']} ({record['region']}): Delivery charge {record['delivery_charge']}{settings['currency']}, Delivery time {record['delivery_time']}"
@@ -95,34 +140,61 @@ products = [
     {'category': 'Shoes', 'type': 'Dress Shoes', 'size': ['36', '37', '38', '39', '40'], 'color': ['Black', 'Orange'], 'image': 'https://ezbo.org/product-image/uploads/img_682c99d3d32951.87415347.jpg', 'price': 950}
 ]
 
+store.import_once("products", lambda: products)
+products[:] = store.load_products()
+
 def get_products():
     return products
 
+def sync_product_images():
+    """Bring the image feature store in line with the catalog, computing new images in the background"""
+    return feature_store.sync(p.get("image") for p in products)
+
 def add_product(product):
+    store.insert_product(len(products), product)
     products.append(product)
+    bump_version("catalog")
+    feature_store.warm([product.get("image")] if product.get("image") else [])
 
 def update_product(index, product):
     if 0 <= index < len(products):
+        old_image = products[index].get("image")
+        store.update_product(index, product)
         products[index] = product
+        bump_version("catalog")
+        # The file behind an unchanged URL may have been replaced too, so always recompute
+        feature_store.invalidate(old_image)
+        feature_store.invalidate(product.get("image"))
+        sync_product_images()
 
 def remove_product(index):
     if 0 <= index < len(products):
-        products.pop(index)
+        store.delete_product(index)
+        product = products.pop(index)
+        bump_version("catalog")
+        sync_product_images()
+        return product
 
-# Orders List
-orders = [
-
-]
+# Orders List, mirrored from the store; each order carries its store id
+orders = []
 # Sales Logs List
 sales_logs = []
+_orders_lock = threading.Lock()
+
+SALES_LOG_RETENTION_DAYS = int(os.getenv("SALES_LOG_RETENTION_DAYS", "60"))  # 0 keeps sales logs forever
+SALES_LOG_RETENTION_INTERVAL = int(os.getenv("SALES_LOG_RETENTION_INTERVAL", str(24 * 3600)))  # seconds between retention runs
 
 def get_orders():
     return orders
 
 def add_order(order):
-    orders.append(order)
-    update_github_repo_orders(orders)
-    logger.info("New order added and GitHub repository updated.")
+    with _orders_lock:
+        order["id"] = store.insert_order(order)
+        orders.append(order)
+        analytics.order_added(order)
+        bump_version("orders")
+    backup_orders()
+    logger.info("New order added.")
     
     # Send email notification for new orders
     try:
@@ -132,207 +204,233 @@ def add_order(order):
         logger.error(f"Failed to send order notification email: {str(e)}")
 
 def update_order_status(index, status):
-    if 0 <= index < len(orders):
-        orders[index]["status"] = status
-        if status in ["Delivered", "Canceled"]:
-            orders[index]["date"] = datetime.datetime.now().strftime("%Y-%m-%d")
-            sales_logs.append(orders.pop(index))
-            save_sales_logs_to_github()
-
-def remove_old_logs():
-    global sales_logs
-    cutoff_date = datetime.datetime.now() - datetime.timedelta(days=60)
-    sales_logs = [log for log in sales_logs if datetime.datetime.strptime(log.get("date", "1970-01-01"), "%Y-%m-%d") >= cutoff_date]
-    save_sales_logs_to_github()
+    with _orders_lock:
+        if not 0 <= index < len(orders):
+            return
+        old_status = orders[index].get("status")
+        order = dict(orders[index], status=status)
+        closed = status in ["Delivered", "Canceled"]
+        if closed:
+            order["date"] = datetime.datetime.now().strftime("%Y-%m-%d")
+            # The archive append runs inside the store transaction: both happen or neither does
+            store.close_order(order, archive=sales_log_archive.append)
+            partition = partition_of(order)
+            orders.pop(index)
+            sales_logs.append(order)
+        else:
+            store.update_order(order)
+            orders[index] = order
+        analytics.order_updated(old_status, order, closed)
+        bump_version("orders")
+    backup_orders()
+    if closed:
+        save_sales_logs_to_github([partition], urgent=True)
 
-def save_sales_logs_to_github():
-    try:
-        github = Github(os.getenv("GITHUB_ACCESS_TOKEN"))
-        repo = github.get_repo(os.getenv("GITHUB_REPO_NAME"))
-        
-        # Get current content or create file if it doesn't exist
+def get_sales_logs(start=None, end=None):
+    """Sales logs dated from start to end (YYYY-MM-DD, inclusive); only that range's monthly segments are read"""
+    if start is None and end is None:
+        return sales_logs
+    return list(sales_log_archive.read(start, end))
+
+def retention_cutoff(days=SALES_LOG_RETENTION_DAYS):
+    """First day (YYYY-MM-DD) of the oldest retained month; None when sales logs are kept forever"""
+    if days <= 0:
+        return None
+    # Retention works in whole months, so it removes segments instead of rewriting them
+    return (datetime.date.today() - datetime.timedelta(days=days)).strftime("%Y-%m-01")
+
+def remove_old_logs(days=SALES_LOG_RETENTION_DAYS):
+    """Drop the sales logs of months entirely outside the retention window; returns the months dropped"""
+    cutoff = retention_cutoff(days)
+    if cutoff is None:
+        return []
+    with _orders_lock:
+        store.delete_sales_logs_before(cutoff)
+        dropped = sales_log_archive.drop_before(cutoff)
+        kept = [log for log in sales_logs if (log.get("date") or "") >= cutoff]
+        if len(kept) < len(sales_logs):
+            analytics.sales_logs_removed([log for log in sales_logs if (log.get("date") or "") < cutoff])
+        sales_logs[:] = kept
+    for partition in dropped:
+        github_sync.mark_deleted(sales_log_github_path(partition))
+    if dropped:
+        logger.info(f"Dropped sales logs for {', '.join(dropped)}")
+    return dropped
+
+def _retention_loop():
+    while True:
         try:
-            content = repo.get_contents("templates/saleslogs.txt")
-            logs_str = "\n".join([str(log) for log in sales_logs])
-            repo.update_file(
-                path="templates/saleslogs.txt",
-                message="Update sales logs via chatbot",
-                content=logs_str,
-                sha=content.sha
-            )
+            remove_old_logs()
         except Exception as e:
-            if "404" in str(e):
-                repo.create_file(
-                    path="templates/saleslogs.txt",
-                    message="Initialize sales logs file",
-                    content="\n".join([str(log) for log in sales_logs]),
-                    branch="main"
-                )
-        
-        logger.info("Sales logs saved to GitHub.")
-    except Exception as e:
-        logger.error(f"Failed to save sales logs to GitHub: {str(e)}")
+            logger.error(f"Sales log retention failed: {str(e)}")
+        time.sleep(SALES_LOG_RETENTION_INTERVAL)
+
+SALES_LOGS_DIR = "templates/saleslogs"
+SINGLE_FILE_SALES_LOGS_PATH = "templates/saleslogs.jsonl"
+LEGACY_SALES_LOGS_PATH = "templates/saleslogs.txt"
+
+def sales_log_github_path(partition):
+    return f"{SALES_LOGS_DIR}/{partition}.jsonl"
+
+def save_sales_logs_to_github(partitions=None, urgent=False):
+    """Queue monthly segments (all by default) for the GitHub backup; each is read when the sync commit is made"""
+    for partition in sales_log_archive.partitions() if partitions is None else partitions:
+        github_sync.mark_dirty(sales_log_github_path(partition), functools.partial(sales_log_archive.text, partition), urgent)
 
 def load_sales_logs_from_github():
-    try:
-        github = Github(os.getenv("GITHUB_ACCESS_TOKEN"))
-        repo = github.get_repo(os.getenv("GITHUB_REPO_NAME"))
-        
-        # First try to get the file contents
-        try:
-            content = repo.get_contents("templates/saleslogs.txt")
-            logs_str = content.decoded_content.decode("utf-8").strip()
-            
-            # If file is empty, initialize with empty list
-            if not logs_str:
-                sales_logs.clear()
-                logger.info("Initialized empty sales logs from blank file.")
-                return
-                
-            # Try to parse the logs
-            logs = logs_str.splitlines()
-            sales_logs.clear()
-            for log in logs:
-                if log.strip():  # Skip empty lines
-                    sales_logs.append(eval(log.strip()))
-            logger.info("Sales logs loaded from GitHub.")
-            
-        except Exception as e:
-            # If file doesn't exist, create it
-            if "404" in str(e):
-                repo.create_file(
-                    path="templates/saleslogs.txt",
-                    message="Initialize sales logs file",
-                    content="",
-                    branch="main"
-                )
-                sales_logs.clear()
-                logger.info("Created new sales logs file.")
-            else:
-                raise
-                
-    except Exception as e:
-        logger.error(f"Failed to load sales logs from GitHub: {str(e)}")
-        # Initialize empty sales logs if loading fails
-        sales_logs.clear()
+    """Sales logs from the GitHub backup, used once to seed the store; raises if they can't be read"""
+    paths = github_sync.list_dir(SALES_LOGS_DIR)
+    text = None if paths else github_sync.read(SINGLE_FILE_SALES_LOGS_PATH)
+    if paths:
+        logs = [log for path in paths for log in iter_logs((github_sync.read(path) or "").splitlines())]
+    elif text is not None:
+        logs = list(iter_logs(text.splitlines()))
+    else:
+        # Not migrated yet: the old file holds one dict repr per line
+        logs = list(iter_legacy_logs((github_sync.read(LEGACY_SALES_LOGS_PATH) or "").splitlines()))
+    logger.info("Sales logs loaded from GitHub.")
+    return logs
 
-load_sales_logs_from_github()
+try:
+    # Open orders come back from the GitHub backup, or from the list older versions spliced into this file
+    store.import_once("orders", lambda: load_orders_backup(github_sync.read))
+except Exception as e:
+    # Not marked as imported, so the next start tries again
+    logger.error(f"Failed to restore orders from GitHub: {str(e)}")
+orders[:] = store.load_orders()
+try:
+    store.import_once("sales_logs", load_sales_logs_from_github)
+except Exception as e:
+    # Not marked as imported, so the next start tries again
+    logger.error(f"Failed to load sales logs from GitHub: {str(e)}")
+# Only the retained months are held in memory; older ones are about to be dropped by retention anyway
+sales_logs[:] = store.load_sales_logs(since=retention_cutoff())
+analytics.rebuild(orders, sales_logs)
+if not sales_log_archive.exists():
+    # First start on monthly segments: write them from the store and publish them
+    sales_log_archive.rewrite(sales_logs)
+    save_sales_logs_to_github()
+    if os.path.exists(SINGLE_FILE_PATH):
+        os.remove(SINGLE_FILE_PATH)
+        github_sync.mark_deleted(SINGLE_FILE_SALES_LOGS_PATH)
+threading.Thread(target=_retention_loop, name="sales-log-retention", daemon=True).start()
+
+# Product image features are loaded or computed in the background so the first photo query doesn't pay for them
+sync_product_images()
 
 def update_github_repo_orders(orders):
+    """Back up open orders to a JSON file in the GitHub repo; the local store stays the source of truth"""
+    # Orders go out within seconds, not on the next interval: on a host without a persistent disk the backup is all that survives
+    github_sync.mark_dirty(ORDERS_BACKUP_PATH, encode_orders(orders), urgent=True)
+
+def backup_orders():
+    if not store.imported("orders"):
+        # The backup hasn't been restored yet; overwriting it would lose the orders in it
+        logger.error("Skipping orders backup until the orders in it have been restored")
+        return
+    update_github_repo_orders([dict(o) for o in orders])
+
+IMAGE_ACK_REPLY = "🔍 Checking our catalog for this product, one moment…"
+
+def _image_busy_reply():
+    return "😔 We're checking a lot of photos right now. Please try again in a minute, or tell us which product you're looking for."
+
+IMAGE_DOWNLOAD_THREADS = int(os.getenv("IMAGE_DOWNLOAD_THREADS", "8"))
+
+# Downloads and cache lookups are I/O; only photos not seen before go on to the image worker processes
+_image_threads = ThreadPoolExecutor(max_workers=IMAGE_DOWNLOAD_THREADS, thread_name_prefix="image")
+
+def _run_image_match(image_urls, config):
+    """Runs on a download thread holding a slot from image_jobs.reserve(); the slot passes to the match job, if any"""
+    catalog = [p for p in products if p.get("image")]
+    by_image = {}
+    for product in catalog:
+        by_image.setdefault(product["image"], product)
+    version = get_data_version("catalog")
+    # Workers rebuild their index whenever the catalog or the cached features change
+    catalog_key = (version, feature_store.version)
+
+    results = [(None, 0)] * len(image_urls)
+    misses = []
+    submitted = False
     try:
-        from github import Github
-        github = Github(os.getenv("GITHUB_ACCESS_TOKEN"))
-        repo = github.get_repo(os.getenv("GITHUB_REPO_NAME"))
-        content = repo.get_contents("messageHandler.py")
-        current_content = content.decoded_content.decode("utf-8")
-        start_marker = "# Orders List\norders = ["
-        end_marker = "\n]"
-        start_index = current_content.find(start_marker)
-        end_index = current_content.find(end_marker, start_index) + len(end_marker)
-        if start_index == -1 or end_index == -1:
-            logger.error("Failed to locate the orders block in messageHandler.py")
-            return
-        updated_content = (
-            current_content[:start_index] +
-            f"# Orders List\norders = [\n" +
-            ",\n".join([f"    {repr(order)}" for order in orders]) +
-            "\n]" +
-            current_content[end_index:]
-        )
-        repo.update_file(
-            path="messageHandler.py",
-            message="Update orders via chatbot",
-            content=updated_content,
-            sha=content.sha
-        )
-        logger.info("GitHub repository updated successfully with new orders.")
-    except Exception as e:
-        logger.error(f"Failed to update GitHub repository: {str(e)}")
+        for position, image_url in enumerate(image_urls):
+            started = time.perf_counter()
+            try:
+                data = fetch_image_bytes(image_url)
+            except Exception as e:
+                logger.error(f"Error in image analysis: {str(e)}")
+                continue
+            download_time = time.perf_counter() - started
+            digest = hashlib.sha256(data).hexdigest()
+            cached = image_result_cache.get(digest, version)
+            if cached:
+                # The same photo again: no CV work at all
+                product = by_image.get(cached[0])
+                results[position] = (product, cached[1]) if product else (None, 0)
+            else:
+                misses.append((position, digest, data, download_time))
+
+        if misses:
+            submitted = True
+            job = image_jobs.submit(
+                [data for _, _, data, _ in misses], list(by_image), catalog_key,
+                image_result_cache.near_duplicates(version), config, reserved=True
+            )
+            # Settles by IMAGE_JOB_TIMEOUT at the latest
+            for (position, digest, _, download_time), outcome in zip(misses, job.result()):
+                result, extra, catalog_size, phash = outcome
+                extra = {"download": download_time, **extra}
+                cascade_stats.record(result, catalog_size, extra)
+                logger.info(
+                    f"Image match: compared {result.compared}/{catalog_size}, early exit {result.early_exit}, "
+                    f"near duplicate {result.near_duplicate}, "
+                    + ", ".join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in {**extra, **result.timings}.items())
+                )
+                if phash is not None:
+                    image_result_cache.put(digest, phash, result.key, result.score, version, result.near_duplicate)
+                product = by_image.get(result.key)
+                results[position] = (product, result.score) if product else (None, 0)
+    finally:
+        if not submitted:
+            image_jobs.release()
+    return results
 
-def analyze_and_match_product(image_url):
+def submit_image_match(image_urls, config=None):
+    """Start matching customer images; a Future of [(product, score)] per image that fails after IMAGE_JOB_TIMEOUT, or ImageQueueFull at once"""
+    # The slot is taken before the download is queued, so waiting downloads count against the cap too
+    image_jobs.reserve()
     try:
-        # Download the user's image
-        response = requests.get(image_url)
-        user_img = Image.open(BytesIO(response.content))
-        user_img = np.array(user_img)
-        
-        # Convert to grayscale and resize for comparison
-        user_gray = cv2.cvtColor(user_img, cv2.COLOR_BGR2GRAY)
-        user_gray = cv2.resize(user_gray, (250, 250))
-        
-        # Apply preprocessing to handle quality variations
-        user_gray = cv2.GaussianBlur(user_gray, (5,5), 0)
-        _, user_gray = cv2.threshold(user_gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        
-        best_match = None
-        highest_score = 0
-        
-        # Compare with all product images
-        for product in products:
-            if 'image' in product and product['image']:
-                try:
-                    # Download product image
-                    product_response = requests.get(product['image'])
-                    product_img = Image.open(BytesIO(product_response.content))
-                    product_img = np.array(product_img)
-                    
-                    # Convert to grayscale and resize
-                    product_gray = cv2.cvtColor(product_img, cv2.COLOR_BGR2GRAY)
-                    product_gray = cv2.resize(product_gray, (250, 250))
-                    
-                    # Apply same preprocessing to product image
-                    product_gray = cv2.GaussianBlur(product_gray, (5,5), 0)
-                    _, product_gray = cv2.threshold(product_gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-                    
-                    # Calculate similarity score using multiple methods
-                    ssim_score = ssim(user_gray, product_gray)
-                    
-                    # Additional matching techniques
-                    orb = cv2.ORB_create()
-                    kp1, des1 = orb.detectAndCompute(user_gray, None)
-                    kp2, des2 = orb.detectAndCompute(product_gray, None)
-                    
-                    if des1 is not None and des2 is not None:
-                        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-                        matches = bf.match(des1, des2)
-                        match_score = len(matches) / max(len(des1), len(des2)) if matches else 0
-                    else:
-                        match_score = 0
-                    
-                    # Combined score (weighted average)
-                    combined_score = (ssim_score * 0.7) + (match_score * 0.3)
-                    
-                    # Update best match if this is better
-                    if combined_score > highest_score:
-                        highest_score = combined_score
-                        best_match = product
-                        
-                except Exception as e:
-                    logger.error(f"Error processing product image {product['image']}: {str(e)}")
-                    continue
-        
-        # Return best match if similarity score is above threshold
-        if best_match and highest_score > 0.4:  # Lowered threshold to 40% for better matching
-            return best_match, highest_score
-            
-    except Exception as e:
-        logger.error(f"Error in image analysis: {str(e)}")
-    
-    return None, 0
-    
+        work = _image_threads.submit(_run_image_match, list(image_urls), config)
+    except Exception:
+        image_jobs.release()
+        raise
+    return image_jobs.with_deadline(work)
+
+def match_product_images(image_urls, config=None):
+    """Best catalog match per customer image as [(product, score)], (None, 0) where nothing is close enough"""
+    return submit_image_match(image_urls, config).result()
+
 def extract_image_url(message):
     """Extract image URL from message text"""
     if message.startswith("image_url:"):
         return message.split("image_url:")[1].strip()
     return None
 
-# Optimized system instruction template
-def get_system_instruction():
-    time_now = time.asctime(time.localtime(time.time()))
-    product_list = format_product_list()
-    order_list = format_order_list()
+# Memoized system instruction sections, each keyed by the data versions it depends on
+_section_cache = {}
+
+def _memoized_section(name, kinds, builder):
+    version = get_data_version(*kinds)
+    cached = _section_cache.get(name)
+    if cached and cached[0] == version:
+        return cached[1]
+    value = builder()
+    _section_cache[name] = (version, value)
+    return value
+
+def _format_instruction_header():
     delivery_records = format_delivery_records()
-    
     return f"""# {settings['shop_name']} AI Chatbot System Instructions
 
 ## Introduction
@@ -367,13 +465,10 @@ When customer selects a payment method:
 3. Request transaction ID if needed
 Example: "Please send {850 + 130} = 980{settings['currency']} to Nagad: {settings['payment_methods']['nagad_number']} (Personal). Send the Transaction ID after payment."
 
-## Product Catalog
-{product_list}
-
-## Current Orders
-{order_list}
+"""
 
-## Behavior Guidelines
+def _format_instruction_guidelines():
+    return f"""## Behavior Guidelines
 1. Keep replies short 1 to 2 lines max. Sound natural and do your best to sell the product to the customer.
 2. Language Handling – Send messages in the same language the user uses. If the user requests a language switch, switch to the requested language.
 3. Product inquiries: Ask for details if needed (size, color) or picture.
@@ -399,176 +494,554 @@ Your order has been placed!
    - Price: [Price]{settings['currency']}
    - Payment Method: [Method]{" (Txn ID: [ID])" if "[Method]" != "COD" else ""}
    - Total: [Total]{settings['currency']}
+Right after the confirmation message, add the same order on one line as JSON between {OPEN_TAG} and {CLOSE_TAG}, with numbers for price and total:
+{OPEN_TAG}{{"name": "...", "mobile": "...", "address": "...", "product": "...", "price": 0, "payment_method": "...", "transaction_id": "...", "total": 0}}{CLOSE_TAG}
 
 ## Reply after Order Confirmation
 After sending order confirmation message, if the user responds with anything acknowledge it naturally without repeating the order confirmation message.
 
 ## Order Inquiry
-If a customer inquires about their order, such as an update, status, or details, request their name and mobile number. If both the word-for-word name and digit-for-digit number do not match exactly from start 
-to end, ask them to try again. Once an exact match is found, provide the order status.
+If a customer inquires about their order, such as an update, status, or details, request their name and mobile number. The "Order Lookup" section shows the order matching the exact name and number given in this conversation.
+If it says no order matches, ask them to try again. Once a match is shown, provide the order status.
 
 ## Handling Critical Issues Beyond AI's Capability
 If a customer asks for an order detail change, order cancellation, return, or any situation that requires human assistance, politely direct them to the shop's contact number.
 """
 
-def get_gemini_api_key():
-    try:
-        response = requests.get('https://ezbo.org/api/key-manager.php/123456')
-        response.raise_for_status()
-        data = response.json()
-        return data['api_key']
-    except Exception as e:
-        logger.error(f"Error fetching API key: {str(e)}")
-        raise RuntimeError("Failed to fetch Gemini API key from key manager")
+CATALOG_TOP_N = 8  # products injected into the prompt per message
+HISTORY_LINES = 6  # recent conversation lines used to rank products
 
-def initialize_text_model():
-    api_key = get_gemini_api_key()
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel(
-        model_name="gemini-1.5-flash",
-        generation_config={
-            "temperature": 0.3,
-            "top_p": 0.95,
-            "top_k": 30,
-            "max_output_tokens": 8192,
-        }
+def get_catalog_index():
+    return _memoized_section("catalog_index", ("catalog",), lambda: CatalogIndex(products))
+
+def format_relevant_products(message, history=""):
+    matches = get_catalog_index().search(message, history, top_n=CATALOG_TOP_N)
+    if matches:
+        return (
+            "Most relevant products for this conversation (ask if the customer wants something else):\n"
+            + format_product_list(matches)
+        )
+    summary = _memoized_section(
+        "catalog_summary", ("catalog", "settings"),
+        lambda: format_category_summary(products, settings['currency'])
     )
+    return f"No product matched this conversation. Categories we sell:\n{summary}"
+
+def recent_history(user_message):
+    """Last few lines of the conversation, used to rank products and look up orders"""
+    return "\n".join(user_message.strip().splitlines()[-HISTORY_LINES:])
+
+def get_instruction_sections(message=None, history=""):
+    """The system instruction split into named sections, in prompt order"""
+    header = _memoized_section("header", ("settings",), _format_instruction_header)
+    if message is None:
+        product_list = _memoized_section("catalog", ("catalog", "settings"), format_product_list)
+    else:
+        product_list = format_relevant_products(message, history)
+    order_lookup = format_order_lookup(message, history)
+    guidelines = _memoized_section("guidelines", ("settings",), _format_instruction_guidelines)
+    time_now = time.asctime(time.localtime(time.time()))
+
+    return {
+        "shop_info": header,
+        "catalog": f"## Product Catalog\n{product_list}\n\n",
+        "orders": f"## Order Lookup\n{order_lookup}\n\n",
+        "guidelines": f"{guidelines}\n## Current Time\n{time_now}\n",
+    }
+
+def get_system_instruction(message=None, history=""):
+    return "".join(get_instruction_sections(message, history).values())
+
+def get_gemini_api_key():
+    # Served from the cached key pool; only hits the key manager when the pool expires
+    return key_pool.get_key()
+
+TEXT_MODEL_NAME = "gemini-1.5-flash"
+GENERATION_CONFIG = {
+    "temperature": 0.3,
+    "top_p": 0.95,
+    "top_k": 30,
+    "max_output_tokens": 8192,
+}
 
-def format_product_list():
+# Shared by every bot: a Gemini outage opens the circuit for all of them at once
+llm_retry_policy = RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=8.0)
+llm_circuit_breaker = CircuitBreaker(window=20, min_calls=6, failure_rate=0.5, cooldown=30)
+
+# Clients bound to a key are dropped as soon as the pool rotates that key out
+key_pool.add_rotation_listener(model_registry.discard_key)
+
+def initialize_text_model(api_key=None):
+    api_key = api_key or get_gemini_api_key()
+    return model_registry.get_model(TEXT_MODEL_NAME, api_key, GENERATION_CONFIG)
+
+def format_product_list(items=None):
     return "\n".join([
         f"{p['type']} ({p['category']}) - Size: {', '.join(map(str, p['size']))}, Color: {', '.join(p['color'])}, Image: {p.get('image', 'No image')}, Price: {p['price']}{settings['currency']}"
-        for p in products
+        for p in (products if items is None else items)
     ])
 
-def format_order_list():
-    return "\n".join([
-        f"Name: {o['name']}, Mobile: {o['mobile']}, Product: {o['product']}, Status: {o['status']}"
-        for o in orders
-    ])
+def get_order_index():
+    return _memoized_section("order_index", ("orders",), lambda: OrderIndex(orders))
+
+def format_order_lookup(message=None, history=""):
+    """Only the order matching the customer's own name and mobile goes into the prompt"""
+    text = f"{history}\n{message or ''}"
+    matches = get_order_index().find_in_text(text)
+    if matches:
+        return "\n".join(
+            f"Name: {o['name']}, Mobile: {o['mobile']}, Product: {o['product']}, Status: {o['status']}"
+            for o in matches
+        )
+    if is_order_lookup(text):
+        return "No order matches the name and mobile number given so far."
+    return "No order lookup requested."
+
+ERROR_REPLY = "😔 Sorry, I'm having trouble processing your request. Please try again later."
+NO_MATCH_REPLY = "No Match Found!!\n\n- I couldn't find anything matching in our catalog.\n- To help me assist you, please follow these steps:\n\n 1. Visit our Facebook page.\n 2. Download an image of the product you need.\n 3. Send it to me directly.\n\n- You can also describe what you're looking for, I can then show you your needed product with an image."
+
+def format_image_match(matched_product, score):
+    """Reply for one customer image: (response, matched_product)"""
+    if not matched_product:
+        return NO_MATCH_REPLY, None
+    response = (
+        f"I found a similar product in our catalog ({(score*100):.1f}% match):\n"
+        f"{matched_product['type']} ({matched_product['category']})\n"
+        f"Sizes: {', '.join(matched_product['size'])}\n"
+        f"Colors: {', '.join(matched_product['color'])}\n"
+        f"Price: {matched_product['price']}{settings['currency']}\n"
+        f"Image: {matched_product['image']}"
+    )
+    return response, matched_product
 
-def extract_order_details(response):
+def _image_replies(image_urls, matches, error, platform, user_id):
+    """One (response, matched_product) per image, recorded in the user's chat session"""
+    if isinstance(error, (ImageQueueFull, ImageJobTimeout)):
+        replies = [(_image_busy_reply(), None)]
+    elif error is not None:
+        logger.error(f"Error in image analysis: {str(error)}")
+        replies = [(NO_MATCH_REPLY, None)] * len(image_urls)
+    else:
+        replies = [format_image_match(*match) for match in matches]
+    session = get_chat_session(platform, user_id, IMAGE_TURN)
+    for response, _ in replies:
+        remember_turn(session, IMAGE_TURN, response)
+    return replies
+
+def handle_image_attachments(image_urls, platform=None, user_id=None):
+    """Match several attached images in one batch and wait for the result"""
     try:
-        order = {}
-        lines = [line.strip() for line in response.split("\n") if line.strip()]
-        
-        # Check if this is an order confirmation message
-        if "Your order has been placed!" not in response:
-            return None
-            
-        for line in lines:
-            if line.startswith("- Name:"):
-                order["name"] = line.split("Name:")[1].strip()
-            elif line.startswith("- Mobile:"):
-                order["mobile"] = line.split("Mobile:")[1].strip()
-            elif line.startswith("- Address:"):
-                order["address"] = line.split("Address:")[1].strip()
-            elif line.startswith("- Product:"):
-                order["product"] = line.split("Product:")[1].strip()
-            elif line.startswith("- Price:"):
-                price_str = line.split("Price:")[1].split(settings['currency'])[0].strip()
-                order["price"] = int(float(price_str))
-            elif line.startswith("- Payment Method:"):
-                payment_part = line.split("Payment Method:")[1].strip()
-                if "(Txn ID:" in payment_part:
-                    parts = payment_part.split("(Txn ID:")
-                    order["payment_method"] = parts[0].strip()
-                    order["transaction_id"] = parts[1].replace(")", "").strip()
-                else:
-                    order["payment_method"] = payment_part
-            elif line.startswith("- Total:"):
-                total_str = line.split("Total:")[1].split(settings['currency'])[0].strip()
-                order["total"] = int(float(total_str))
-        
-        # Calculate delivery charge
-        if "price" in order and "total" in order:
-            order["delivery_charge"] = order["total"] - order["price"]
-            order["subtotal"] = order["price"]
-        
-        # Set default status
-        order["status"] = "Preparing"
-        
-        # Add date for sales logs
-        order["date"] = datetime.datetime.now().strftime("%Y-%m-%d")
-        
-        return order if all(k in order for k in ['name', 'mobile', 'product', 'price']) else None
-        
+        return _image_replies(image_urls, match_product_images(image_urls), None, platform, user_id)
     except Exception as e:
-        logger.error(f"Error extracting order details: {str(e)}")
+        return _image_replies(image_urls, None, e, platform, user_id)
+
+def handle_image_attachments_deferred(image_urls, deliver, platform=None, user_id=None):
+    """Queue the images and return at once; deliver(replies) is called from a background thread when done"""
+    def send(matches, error):
+        try:
+            deliver(_image_replies(image_urls, matches, error, platform, user_id))
+        except Exception as e:
+            logger.error(f"Error delivering image match: {str(e)}")
+
+    try:
+        future = submit_image_match(image_urls)
+    except Exception as e:
+        send(None, e)
+        return
+
+    def finished(future):
+        error = future.exception()
+        # Delivery does network I/O; keep it off the worker pool's result thread
+        threading.Thread(target=send, args=(None if error else future.result(), error), daemon=True).start()
+
+    future.add_done_callback(finished)
+
+async def handle_image_attachments_async(image_urls, platform=None, user_id=None):
+    """Await the worker pool without blocking the event loop; other conversations keep flowing meanwhile"""
+    try:
+        matches, error = await asyncio.wrap_future(submit_image_match(image_urls)), None
+    except Exception as e:
+        matches, error = None, e
+    # A session rebuild reads the user's memory file
+    return await asyncio.to_thread(_image_replies, image_urls, matches, error, platform, user_id)
+
+def get_session_instruction():
+    """The part of the system instruction that only changes with the settings, sent once per chat session"""
+    return _memoized_section(
+        "session_instruction", ("settings",),
+        lambda: _format_instruction_header() + _format_instruction_guidelines()
+    )
+
+def get_chat_session(platform, user_id, session_text):
+    """The user's live chat session, rebuilt from stored memory after a restart or eviction"""
+    if not (platform and user_id):
         return None
 
-def handle_text_message(user_message, last_message):
-    max_retries = 3  # Maximum number of retries for API errors
-    retry_delay = 1  # Delay between retries in seconds
-    
-    for attempt in range(max_retries):
+    def load_turns():
+        turns = get_conversation_turns(platform, user_id)
+        # The bots store the incoming message before replying; it is sent as this turn instead
+        if turns and turns[-1]["role"] == "user" and turns[-1]["text"] == session_text:
+            turns.pop()
+        return turns
+
+    def load_summary():
+        return ConversationSummary.from_dict(get_user_summary(platform, user_id))
+
+    session = session_manager.get(
+        platform, user_id, get_session_instruction, get_data_version("settings"), load_turns, load_summary
+    )
+    compact_session(session)
+    return session
+
+def compact_session(session):
+    """Fold turns beyond the history token budget into the stored running summary"""
+    older = session.compact()
+    if not older:
+        return
+    with session.lock:
+        session.summary.absorb(older, products)
+        summary = session.summary.to_dict()
+    # The summary is pushed to GitHub; don't hold up the reply for it
+    threading.Thread(target=save_user_summary, args=(*session.owner, summary), daemon=True).start()
+
+def build_prompt(user_message, last_message, session=None):
+    """Return the chat history, the prompt and its sections by name, for token accounting"""
+    # Rank the catalog against the new message and the last few turns only
+    query_text = last_message if last_message and not last_message.startswith("[") else user_message
+    if session is None:
+        sections = get_instruction_sections(query_text, recent_history(user_message))
+        system_instruction = "".join(sections.values())
+        history, separator, message = user_message.rpartition("\n\nUser: ")
+        sections["history"] = history + separator
+        sections["message"] = message
+        return [], f"{system_instruction}\n\nHuman: {user_message}", sections
+
+    # The session already holds the static instruction and recent turns; only per-message context is sent
+    summary = session.summary.render()
+    # Order details that scrolled out of the window still count for the order lookup
+    lookup_history = f"{session.summary.order_text()}\n{session.recent_text(HISTORY_LINES)}"
+    dynamic = get_instruction_sections(query_text, lookup_history)
+    time_now = time.asctime(time.localtime(time.time()))
+    context = f"{summary}{dynamic['catalog']}{dynamic['orders']}## Current Time\n{time_now}\n"
+    history, message = session.prepare(f"{context}\nUser: {user_message}")
+    sections = {
+        "instruction": history[0]["parts"][0],
+        "history": "\n".join(c["parts"][0] for c in history[1:]),
+        "summary": summary,
+        "catalog": dynamic["catalog"],
+        "orders": dynamic["orders"],
+        "message": message.replace(context, "", 1),
+    }
+    return history, message, sections
+
+def finalize_response(text, turn):
+    """Clean the model's reply and record an order if it is a confirmation; turn identifies the message it answers"""
+    simplified_response = strip_order_block(text).strip().replace("*", "")
+
+    # One confirmation is one order, even if the same reply is processed twice
+    order_details = extract_order(text)
+    if order_details and not order_deduplicator.claim(text, turn):
+        logger.warning(f"Skipped duplicate order confirmation for turn {turn}: {order_details}")
+    elif order_details:
+        add_order(order_details)
+    elif ORDER_PLACED in simplified_response and not order_details:
+        logger.error(f"Could not parse order confirmation: {simplified_response}")
+
+    return simplified_response
+
+def _busy_reply():
+    return f"😔 We're receiving a lot of messages right now. Please try again in a minute or call us at {settings['shop_number']}."
+
+def _on_llm_error(error, attempt):
+    logger.error(f"LLM call failed (attempt {attempt + 1}, {classify_error(error)}): {str(error)}")
+
+def _send_with_key(send):
+    """Run send(api_key) with the next pooled key and feed the outcome back into the key's health"""
+    api_key = get_gemini_api_key()
+    try:
+        result = send(api_key)
+    except Exception as e:
+        # Bench the key and report it to the key manager in the background
+        if classify_error(e) != FATAL:
+            key_pool.report_error(api_key)
+        raise
+    key_pool.report_success(api_key)
+    return result
+
+IMAGE_TURN = "[User sent an image]"
+
+def remember_turn(session, user_text, reply):
+    if session is None or not reply:
+        return
+    session.add_turn(user_text, reply)
+    if ORDER_PLACED in reply:
+        # The order is recorded; stop pinning its details
+        with session.lock:
+            session.summary.order = {}
+    compact_session(session)
+
+def cache_reply(last_message, history, cache_version, reply, sections):
+    """Share a reply with other customers only if it was written without this customer's earlier turns or summary"""
+    if sections["history"].strip() or sections.get("summary", "").strip():
+        # It may use their name or lean on what they said before
+        return
+    response_cache.put(last_message, history, cache_version, reply)
+
+def quick_reply(last_message, history, cache_version):
+    """Answer simple lookups from templates or the response cache; None when the LLM is needed"""
+    if not last_message:
+        return None
+    return (
+        intent_router.route(last_message, history, products, settings)
+        or response_cache.get(last_message, history, cache_version)
+    )
+
+def handle_text_message(user_message, last_message, platform=None, user_id=None):
+    logger.info(f"Processing text message: {user_message}")
+
+    # Check if this is an image attachment
+    if "image_url:" in user_message.lower():
+        image_url = extract_image_url(user_message.strip())
+        if image_url:
+            return handle_image_attachments([image_url], platform, user_id)[0]
+
+    session = get_chat_session(platform, user_id, user_message)
+    history = session.recent_text(HISTORY_LINES) if session else recent_history(user_message)
+    cache_version = get_data_version("catalog", "settings")
+    quick = quick_reply(last_message, history, cache_version)
+    if quick:
+        remember_turn(session, user_message, quick)
+        return quick, None
+
+    chat_history, prompt, sections = build_prompt(user_message, last_message, session)
+
+    def send(api_key):
+        # Reuse the key's long-lived client; each retry rotates to the next pooled key
+        chat = initialize_text_model(api_key).start_chat(history=chat_history)
+        return chat.send_message(prompt)
+
+    started = time.perf_counter()
+    try:
+        response = call_with_retry(lambda attempt: _send_with_key(send), llm_retry_policy, llm_circuit_breaker, _on_llm_error)
+        text = response.text
+    except CircuitOpenError:
+        return _busy_reply(), None
+    except Exception:
+        return ERROR_REPLY, None
+    usage_tracker.record(platform, user_id, sections, text, time.perf_counter() - started,
+                         getattr(response, "usage_metadata", None))
+    reply = finalize_response(text, (platform, user_id, user_message))
+    cache_reply(last_message, history, cache_version, reply, sections)
+    remember_turn(session, user_message, reply)
+    return reply, None
+
+def stream_text_message(user_message, last_message, platform=None, user_id=None):
+    """Yield the reply in chunks as Gemini generates it; order detection runs on the full text at the end"""
+    logger.info(f"Streaming text message: {user_message}")
+    session = get_chat_session(platform, user_id, user_message)
+    history = session.recent_text(HISTORY_LINES) if session else recent_history(user_message)
+    cache_version = get_data_version("catalog", "settings")
+    quick = quick_reply(last_message, history, cache_version)
+    if quick:
+        remember_turn(session, user_message, quick)
+        yield quick
+        return
+
+    chat_history, prompt, sections = build_prompt(user_message, last_message, session)
+    started = time.perf_counter()
+
+    def open_stream(api_key):
+        # Retries are only possible until the first chunk reaches the customer
+        chat = initialize_text_model(api_key).start_chat(history=chat_history)
+        chunks = iter(chat.send_message(prompt, stream=True))
+        first = next(chunks, None)
+        return chunks, first.text if first is not None else ""
+
+    try:
+        chunks, first_text = call_with_retry(
+            lambda attempt: _send_with_key(open_stream), llm_retry_policy, llm_circuit_breaker, _on_llm_error
+        )
+    except CircuitOpenError:
+        yield _busy_reply()
+        return
+    except Exception:
+        yield ERROR_REPLY
+        return
+
+    received = []
+    # The order block is for finalize_response only; keep it out of what the customer sees
+    block_filter = OrderBlockFilter()
+    completed = False
+    intact = False  # the whole reply arrived without a streaming error
+    try:
+        try:
+            for text in itertools.chain([first_text], (chunk.text for chunk in chunks)):
+                text = text.replace("*", "")
+                received.append(text)
+                visible = block_filter.feed(text)
+                if visible:
+                    yield visible
+            intact = True
+        except Exception as e:
+            # Part of the reply already reached the customer; a retry would repeat it
+            logger.error(f"Error while streaming reply: {str(e)}")
+            if classify_error(e) != FATAL:
+                llm_circuit_breaker.record_failure()
+        visible = block_filter.flush()
+        if visible:
+            yield visible
+        completed = True
+    finally:
+        # Runs even if the consumer stops reading midway: the customer may already have seen the confirmation
+        if not completed:
+            _drain(chunks, received)
+        full_text = "".join(received)
+        usage_tracker.record(platform, user_id, sections, full_text, time.perf_counter() - started)
+        reply = finalize_response(full_text, (platform, user_id, user_message))
+        if completed and intact:
+            # A reply cut short must not be served to anyone else
+            cache_reply(last_message, history, cache_version, reply, sections)
+        remember_turn(session, user_message, reply)
+
+def _drain(chunks, received):
+    """Read the rest of a reply nobody is listening to any more, so an order in it is still recorded"""
+    try:
+        for chunk in chunks:
+            received.append(chunk.text.replace("*", ""))
+    except Exception as e:
+        logger.error(f"Error while draining an abandoned reply: {str(e)}")
+
+async def _drain_async(chunks, received):
+    try:
+        while True:
+            chunk = await chunks.__anext__()
+            received.append(chunk.text.replace("*", ""))
+    except StopAsyncIteration:
+        pass
+    except Exception as e:
+        logger.error(f"Error while draining an abandoned reply: {str(e)}")
+
+# A sentence ends at . ! ? or the Bangla danda followed by whitespace, or at a blank line
+_sentence_end_re = re.compile(r"(?<=[.!?।])\s+|\n\s*\n")
+_list_item_re = re.compile(r"^\s*-\s", re.MULTILINE)
+
+def iter_sentences(chunks, min_length=20):
+    """Regroup streamed chunks into complete sentences so bots can send them as they arrive"""
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        # Keep list blocks such as the order confirmation in one piece
+        if "Your order has been placed!" in buffer or _list_item_re.search(buffer):
+            continue
+        last_end = None
+        for match in _sentence_end_re.finditer(buffer):
+            if match.start() >= min_length:
+                last_end = match
+        if last_end:
+            sentence, buffer = buffer[:last_end.start()], buffer[last_end.end():]
+            if sentence.strip():
+                yield sentence.strip()
+    if buffer.strip():
+        yield buffer.strip()
+
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "32"))  # concurrent Gemini calls per event loop
+
+# One semaphore per event loop: the Telegram and Discord bots each run their own
+_llm_semaphores = weakref.WeakKeyDictionary()
+
+def _llm_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _llm_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _llm_semaphores[loop] = asyncio.Semaphore(LLM_CONCURRENCY)
+    return semaphore
+
+def initialize_text_model_async(api_key):
+    return model_registry.get_async_model(TEXT_MODEL_NAME, api_key, GENERATION_CONFIG)
+
+async def _send_with_key_async(send):
+    api_key = await key_pool.get_key_async()
+    try:
+        result = await send(api_key)
+    except Exception as e:
+        if classify_error(e) != FATAL:
+            key_pool.report_error(api_key)
+        raise
+    key_pool.report_success(api_key)
+    return result
+
+async def stream_text_message_async(user_message, last_message, platform=None, user_id=None):
+    """Async generator counterpart of stream_text_message"""
+    logger.info(f"Streaming text message async: {user_message}")
+    session = await asyncio.to_thread(get_chat_session, platform, user_id, user_message)
+    history = session.recent_text(HISTORY_LINES) if session else recent_history(user_message)
+    cache_version = get_data_version("catalog", "settings")
+    quick = quick_reply(last_message, history, cache_version)
+    if quick:
+        remember_turn(session, user_message, quick)
+        yield quick
+        return
+
+    chat_history, prompt, sections = build_prompt(user_message, last_message, session)
+    started = time.perf_counter()
+
+    async def open_stream(api_key):
+        chat = initialize_text_model_async(api_key).start_chat(history=chat_history)
+        response = await chat.send_message_async(prompt, stream=True)
+        chunks = response.__aiter__()
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            return chunks, ""
+        return chunks, first.text
+
+    received = []
+    block_filter = OrderBlockFilter()
+    async with _llm_semaphore():
         try:
-            logger.info(f"Processing text message (attempt {attempt + 1}): {user_message}")
-            
-            # Check if this is an image attachment
-            if "image_url:" in user_message.lower():
-                image_url = extract_image_url(user_message)
-                if image_url:
-                    matched_product, score = analyze_and_match_product(image_url)
-                    if matched_product:
-                        response = (
-                            f"I found a similar product in our catalog ({(score*100):.1f}% match):\n"
-                            f"{matched_product['type']} ({matched_product['category']})\n"
-                            f"Sizes: {', '.join(matched_product['size'])}\n"
-                            f"Colors: {', '.join(matched_product['color'])}\n"
-                            f"Price: {matched_product['price']}{settings['currency']}\n"
-                            f"Image: {matched_product['image']}"
-                        )
-                        return response, matched_product
-                    else:
-                        return "No Match Found!!\n\n- I couldn't find anything matching in our catalog.\n- To help me assist you, please follow these steps:\n\n 1. Visit our Facebook page.\n 2. Download an image of the product you need.\n 3. Send it to me directly.\n\n- You can also describe what you're looking for, I can then show you your needed product with an image.", None
-
-            # Get a fresh API key for each attempt
-            api_key = get_gemini_api_key()
-            genai.configure(api_key=api_key)
-            
-            # Initialize Gemini model with fresh configuration
-            model = genai.GenerativeModel(
-                model_name="gemini-1.5-flash",
-                generation_config={
-                    "temperature": 0.3,
-                    "top_p": 0.95,
-                    "top_k": 30,
-                    "max_output_tokens": 8192,
-                }
+            chunks, first_text = await call_with_retry_async(
+                lambda attempt: _send_with_key_async(open_stream), llm_retry_policy, llm_circuit_breaker, _on_llm_error
             )
-            
-            system_instruction = get_system_instruction()
-            
-            chat = model.start_chat(history=[])
-            response = chat.send_message(f"{system_instruction}\n\nHuman: {user_message}")
-            
-            simplified_response = response.text.strip()
-            simplified_response = simplified_response.replace("*", "")
-            
-            # Check if this is an order confirmation
-            if "Your order has been placed!" in simplified_response:
-                order_details = extract_order_details(simplified_response)
-                if order_details:
-                    add_order(order_details)
-                    update_github_repo_orders(orders)
-                    logger.info("New order added and GitHub repository updated.")
-            
-            return simplified_response, None
+        except CircuitOpenError:
+            yield _busy_reply()
+            return
+        except Exception:
+            yield ERROR_REPLY
+            return
 
-        except Exception as e:
-            logger.error(f"Error processing text message (attempt {attempt + 1}): {str(e)}")
-            
-            # Report the error to key manager
+        completed = False
+        intact = False  # the whole reply arrived without a streaming error
+        try:
             try:
-                if 'api_key' in locals():
-                    requests.get(f'https://ezbo.org/api/key-manager.php?action=report_error&key={api_key}')
-            except Exception as report_error:
-                logger.error(f"Failed to report key error: {str(report_error)}")
-            
-            # If this was the last attempt, return the error message
-            if attempt == max_retries - 1:
-                return "😔 Sorry, I'm having trouble processing your request. Please try again later.", None
-            
-            # Wait before retrying
-            time.sleep(retry_delay)
-            continue
+                text = first_text
+                while True:
+                    text = text.replace("*", "")
+                    received.append(text)
+                    visible = block_filter.feed(text)
+                    if visible:
+                        yield visible
+                    try:
+                        chunk = await chunks.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    text = chunk.text
+                intact = True
+            except Exception as e:
+                logger.error(f"Error while streaming reply: {str(e)}")
+                if classify_error(e) != FATAL:
+                    llm_circuit_breaker.record_failure()
+            visible = block_filter.flush()
+            if visible:
+                yield visible
+            completed = True
+        finally:
+            # Runs even if the consumer stops reading midway: the customer may already have seen the confirmation
+            if not completed:
+                await _drain_async(chunks, received)
+            full_text = "".join(received)
+            usage_tracker.record(platform, user_id, sections, full_text, time.perf_counter() - started)
+            reply = await asyncio.to_thread(finalize_response, full_text, (platform, user_id, user_message))
+            if completed and intact:
+                # A reply cut short must not be served to anyone else
+                cache_reply(last_message, history, cache_version, reply, sections)
+            remember_turn(session, user_message, reply)
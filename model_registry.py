@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+import google.generativeai as genai
+from google.ai import generativelanguage as glm
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+MAX_MODELS = 16  # a few generation configs for every key in the pool
+
+def _config_key(generation_config):
+    return tuple(sorted((generation_config or {}).items()))
+
+class ModelRegistry:
+    """Long-lived GenerativeModel clients keyed by (model, api key, generation config)"""
+
+    def __init__(self, max_models=MAX_MODELS):
+        self.max_models = max_models
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _build(self, model_name, api_key, generation_config, loop=None):
+        model = genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+        # Bind a dedicated client to the model so threads never reconfigure the global genai module
+        if loop is None:
+            model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        else:
+            model._async_client = glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+        return model
+
+    def get_async_model(self, model_name, api_key, generation_config=None):
+        """Model for the *_async calls; gRPC aio channels belong to one loop, so models are cached per loop"""
+        return self.get_model(model_name, api_key, generation_config, loop=asyncio.get_running_loop())
+
+    def get_model(self, model_name, api_key, generation_config=None, loop=None):
+        key = (model_name, api_key, _config_key(generation_config), id(loop) if loop else None)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                return model
+
+        model = self._build(model_name, api_key, generation_config, loop)
+        with self._lock:
+            # Another thread may have built the same model meanwhile; keep the first one
+            model = self._models.setdefault(key, model)
+            self._models.move_to_end(key)
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+        logger.info(f"Built {model_name} client for key ...{api_key[-4:]}")
+        return model
+
+    def discard_key(self, api_key):
+        """Drop every client bound to a key that has been rotated out"""
+        with self._lock:
+            for key in [k for k in self._models if k[1] == api_key]:
+                del self._models[key]
+
+model_registry = ModelRegistry()
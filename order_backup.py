@@ -0,0 +1,23 @@
+import ast
+import json
+
+ORDERS_BACKUP_PATH = "templates/orders.json"
+LEGACY_ORDERS_SOURCE = "messageHandler.py"  # orders used to be spliced into this file's source
+
+def encode_orders(orders):
+    return json.dumps(orders, ensure_ascii=False, indent=2)
+
+def parse_legacy_orders(source):
+    """The `orders = [...]` literal in the old messageHandler.py source, read with ast and never executed"""
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == "orders" for t in node.targets):
+            return [order for order in ast.literal_eval(node.value) if isinstance(order, dict)]
+    return []
+
+def load_orders_backup(read):
+    """Open orders to restore: the JSON backup if there is one, else the list in the old source; read(path) gives text or None"""
+    text = read(ORDERS_BACKUP_PATH)
+    if text is not None:
+        return [order for order in json.loads(text) if isinstance(order, dict)]
+    source = read(LEGACY_ORDERS_SOURCE)
+    return parse_legacy_orders(source) if source else []
@@ -0,0 +1,64 @@
+import re
+from collections import defaultdict
+from catalog_index import BANGLA_DIGITS
+
+# Status/tracking wording; plain sales words like "order" or "delivery" are left out so new orders don't read as lookups
+STATUS_KEYWORDS = (
+    "status", "track", "tracking", "where is my", "my order", "my parcel", "shipped", "update on",
+    "kobe pabo", "kothay", "স্ট্যাটাস", "আমার অর্ডার", "পার্সেল", "কবে পাব", "কোথায়",
+)
+
+_mobile_re = re.compile(r"\+?[\d\-\s]{10,16}\d")
+
+def normalize_mobile(mobile):
+    """Reduce a Bangladeshi number to its local 11-digit form (01XXXXXXXXX)"""
+    digits = re.sub(r"\D", "", str(mobile).translate(BANGLA_DIGITS))
+    if digits.startswith("880"):
+        digits = "0" + digits[3:]
+    elif digits.startswith("88") and len(digits) == 13:
+        digits = digits[2:]
+    return digits
+
+def normalize_name(name):
+    return " ".join(re.findall(r"\w+", str(name).lower()))
+
+def extract_mobiles(text):
+    """Every plausible mobile number in a message, normalized"""
+    found = []
+    for match in _mobile_re.findall(str(text).translate(BANGLA_DIGITS)):
+        mobile = normalize_mobile(match)
+        if 10 <= len(mobile) <= 11 and mobile not in found:
+            found.append(mobile)
+    return found
+
+def is_order_lookup(text):
+    """Whether the customer tried to look up an order: status wording plus a mobile number"""
+    lowered = str(text).lower()
+    return any(keyword in lowered for keyword in STATUS_KEYWORDS) and bool(extract_mobiles(text))
+
+class OrderIndex:
+    """Exact lookup of orders by normalized mobile number and name"""
+
+    def __init__(self, orders):
+        self.orders = list(orders)
+        self.by_mobile = defaultdict(list)
+        self.by_name = defaultdict(list)
+        for position, order in enumerate(self.orders):
+            self.by_mobile[normalize_mobile(order.get("mobile", ""))].append(position)
+            self.by_name[normalize_name(order.get("name", ""))].append(position)
+
+    def lookup(self, name, mobile):
+        """Orders whose name and mobile both match exactly after normalization"""
+        by_name = set(self.by_name.get(normalize_name(name), ()))
+        return [self.orders[p] for p in self.by_mobile.get(normalize_mobile(mobile), ()) if p in by_name]
+
+    def find_in_text(self, text):
+        """Resolve orders from free text: a mobile number must appear along with the order's full name"""
+        normalized_text = f" {normalize_name(text)} "
+        matches = []
+        for mobile in extract_mobiles(text):
+            for position in self.by_mobile.get(mobile, ()):
+                order = self.orders[position]
+                if f" {normalize_name(order.get('name', ''))} " in normalized_text and order not in matches:
+                    matches.append(order)
+        return matches
@@ -0,0 +1,199 @@
+import re
+import json
+import time
+import hashlib
+import datetime
+import threading
+from catalog_index import BANGLA_DIGITS
+
+ORDER_PLACED = "Your order has been placed!"
+OPEN_TAG = "<order>"
+CLOSE_TAG = "</order>"
+MIN_MOBILE_DIGITS = 10  # a Bangladeshi mobile has 11; anything much shorter is a placeholder or a typo
+
+# Field -> (type, required). Numbers may arrive as "850৳" or "850.00" and are coerced.
+ORDER_SCHEMA = {
+    "name": (str, True),
+    "mobile": (str, True),
+    "address": (str, False),
+    "product": (str, True),
+    "price": (int, True),
+    "payment_method": (str, False),
+    "transaction_id": (str, False),
+    "total": (int, False),
+}
+
+# Label variants the model uses, English and Bangla; longer labels first so "payment method" wins over "payment"
+FIELD_LABELS = {
+    "payment_method": ("payment method", "payment", "পেমেন্ট মেথড", "পেমেন্ট পদ্ধতি", "পেমেন্ট"),
+    "transaction_id": ("transaction id", "txn id", "trx id", "ট্রানজেকশন আইডি"),
+    "name": ("customer name", "name", "নাম"),
+    "mobile": ("mobile number", "mobile", "phone", "contact", "মোবাইল নম্বর", "মোবাইল", "ফোন"),
+    "address": ("delivery address", "address", "ঠিকানা"),
+    "product": ("product", "item", "পণ্য", "প্রোডাক্ট"),
+    "price": ("price", "দাম", "মূল্য"),
+    "total": ("total amount", "total", "মোট"),
+}
+_label_to_field = {label: field for field, labels in FIELD_LABELS.items() for label in labels}
+_label_pattern = "|".join(re.escape(label) for label in sorted(_label_to_field, key=len, reverse=True))
+
+# "- Name: X", "**Name:** X", "• নাম: X", in any order
+_field_re = re.compile(
+    rf"^[\s\-*•>]*(?P<label>{_label_pattern})[\s*_]*[:：][\s*_]*(?P<value>.+?)[\s*_]*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_block_re = re.compile(rf"{re.escape(OPEN_TAG)}\s*(?P<body>.*?)\s*(?:{re.escape(CLOSE_TAG)}|$)", re.DOTALL)
+_txn_re = re.compile(r"\(\s*(?:txn|trx|transaction)\s*id\s*[:：]?\s*(?P<id>[^)]*)\)", re.IGNORECASE)
+_number_re = re.compile(r"\d[\d,]*(?:\.\d+)?")
+_placeholder_re = re.compile(r"\s*(?:\.{2,}|…|\[[^\]]*\]|<[^>]*>|n/?a|none|null)?\s*", re.IGNORECASE)
+
+def _to_int(value):
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = _number_re.search(str(value).translate(BANGLA_DIGITS))
+    return int(float(match.group().replace(",", ""))) if match else None
+
+def validate_order(data):
+    """Coerce a parsed order to ORDER_SCHEMA; None if a required field is missing or malformed"""
+    if not isinstance(data, dict):
+        return None
+    order = {}
+    for field, (kind, required) in ORDER_SCHEMA.items():
+        value = data.get(field)
+        if isinstance(value, str):
+            value = value.strip()
+        if value in (None, ""):
+            if required:
+                return None
+            continue
+        if kind is int:
+            value = _to_int(value)
+            if value is None:
+                return None
+        else:
+            value = str(value)
+        if field == "mobile":
+            value = value.translate(BANGLA_DIGITS)
+        order[field] = value
+    if order.get("transaction_id", "").lower() in ("none", "n/a", "null"):
+        del order["transaction_id"]
+    # The prompt's own template echoed back ("...", "[Name]") is not an order
+    if any(_placeholder_re.fullmatch(order.get(field, "")) for field in ("name", "mobile", "product")):
+        return None
+    if len(re.sub(r"\D", "", order["mobile"])) < MIN_MOBILE_DIGITS or order["price"] <= 0:
+        return None
+    return order
+
+def parse_order_block(text):
+    """The JSON order block the model appends to a confirmation, validated; None if absent or invalid"""
+    match = _block_re.search(text)
+    if not match:
+        return None
+    try:
+        return validate_order(json.loads(match.group("body")))
+    except ValueError:
+        return None
+
+def parse_order_text(text):
+    """Tolerant fallback for plain-text confirmations: asterisks, reordered fields and Bangla labels"""
+    if ORDER_PLACED.lower() not in text.lower():
+        return None
+    data = {}
+    for match in _field_re.finditer(text):
+        field = _label_to_field[match.group("label").lower()]
+        data.setdefault(field, match.group("value").strip())
+    payment = data.get("payment_method", "")
+    txn = _txn_re.search(payment)
+    if txn:
+        data["payment_method"] = payment[:txn.start()].strip()
+        data.setdefault("transaction_id", txn.group("id").strip())
+    return validate_order(data)
+
+def strip_order_block(text):
+    """Remove the machine-readable block so the customer never sees it"""
+    return _block_re.sub("", text).rstrip()
+
+def extract_order(text):
+    """Order from a confirmation reply, preferring the JSON block; None if this reply places no order"""
+    # Only a confirmation places an order; a block without it is the model echoing the format
+    if ORDER_PLACED.lower() not in text.lower():
+        return None
+    order = parse_order_block(text) or parse_order_text(text)
+    if not order:
+        return None
+    if "total" in order:
+        order["delivery_charge"] = order["total"] - order["price"]
+        order["subtotal"] = order["price"]
+    order["status"] = "Preparing"
+    order["date"] = datetime.datetime.now().strftime("%Y-%m-%d")
+    return order
+
+def reply_fingerprint(text, turn):
+    """Identity of one confirmation: the turn it answers plus its order block, or the whole reply if it has none"""
+    match = _block_re.search(text)
+    block = match.group("body") if match else text
+    return hashlib.sha256(repr((turn, block.strip())).encode("utf-8")).hexdigest()
+
+class OrderDeduplicator:
+    """Remembers recently recorded replies so one confirmation produces exactly one write"""
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def claim(self, text, turn):
+        """True the first time this turn's confirmation is seen within the TTL; a new order in a new turn always is"""
+        key = reply_fingerprint(text, turn)
+        now = time.monotonic()
+        with self._lock:
+            self._seen = {k: t for k, t in self._seen.items() if now - t <= self.ttl}
+            if key in self._seen:
+                return False
+            self._seen[key] = now
+            return True
+
+def _tag_prefix(text, tag):
+    """Longest end of text that could be the beginning of tag, e.g. "<ord" for the open tag"""
+    for keep in range(min(len(tag) - 1, len(text)), 0, -1):
+        if tag.startswith(text[-keep:]):
+            return text[-keep:]
+    return ""
+
+class OrderBlockFilter:
+    """Stream filter that passes reply text through and holds back the order block"""
+
+    def __init__(self):
+        self._pending = ""
+        self._in_block = False
+
+    def feed(self, chunk):
+        text, self._pending = self._pending + chunk, ""
+        visible = []
+        while text:
+            if self._in_block:
+                end = text.find(CLOSE_TAG)
+                if end == -1:
+                    # Block text is never shown; only a possible partial "</ord" is kept
+                    self._pending = _tag_prefix(text, CLOSE_TAG)
+                    break
+                # Text after the block is shown again, as strip_order_block does
+                self._in_block = False
+                text = text[end + len(CLOSE_TAG):]
+            else:
+                start = text.find(OPEN_TAG)
+                if start == -1:
+                    # Hold back a trailing "<ord" that may be the start of the tag
+                    self._pending = _tag_prefix(text, OPEN_TAG)
+                    visible.append(text[:len(text) - len(self._pending)])
+                    break
+                visible.append(text[:start])
+                self._in_block = True
+                text = text[start + len(OPEN_TAG):]
+        return "".join(visible)
+
+    def flush(self):
+        pending, self._pending = self._pending, ""
+        return "" if self._in_block else pending
+
+order_deduplicator = OrderDeduplicator()
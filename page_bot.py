@@ -1,9 +1,10 @@
 import os
 import logging
 import requests
-from memory_manager import update_user_memory, get_conversation_history
+from memory_manager import update_user_memory
+from bot_replies import has_product_image, split_product_image
 from dotenv import load_dotenv
-from messageHandler import handle_text_message
+from messageHandler import handle_image_attachments_deferred, stream_text_message, iter_sentences, IMAGE_ACK_REPLY
 
 # Load environment variables
 load_dotenv()
@@ -86,6 +87,40 @@ def send_image(recipient_id, image_url):
     except Exception as e:
         logger.error(f"Error sending image: {str(e)}")
 
+def send_sender_action(recipient_id, action="typing_on"):
+    params = {"access_token": PAGE_ACCESS_TOKEN}
+    data = {
+        "recipient": {"id": recipient_id},
+        "sender_action": action,
+    }
+    try:
+        requests.post("https://graph.facebook.com/v21.0/me/messages", params=params, json=data, timeout=5)
+    except Exception as e:
+        logger.error(f"Error sending sender action: {str(e)}")
+
+def send_reply(recipient_id, response):
+    """Send a reply, turning a "[Product] - [Image URL]" reply into an image plus caption text"""
+    if has_product_image(response):
+        try:
+            product_text, image_url = split_product_image(response)
+            if image_url.startswith(('http://', 'https://')):
+                send_image(recipient_id, image_url)
+                if product_text:
+                    send_message(recipient_id, product_text)
+                    return product_text
+                return ""
+        except Exception as e:
+            logger.error(f"Error processing image URL: {str(e)}")
+    send_message(recipient_id, response)
+    return response
+
+def deliver_image_replies(recipient_id, replies):
+    """Send finished image match results; runs after the webhook has already returned"""
+    for response, matched_product in replies:
+        send_message(recipient_id, response)
+        if matched_product:
+            update_user_memory("facebook", recipient_id, response, role="model")
+
 def handle_facebook_message(data):
     logger.info("Received data: %s", data)
 
@@ -121,42 +156,33 @@ def handle_facebook_message(data):
 
                     image_processed = False
                     if message_attachments:
-                        for attachment in message_attachments:
-                            if attachment.get("type") == "image" and not is_thumbs_up:
-                                image_url = attachment["payload"].get("url")
-                                if image_url:
-                                    update_user_memory("facebook", sender_id, "[User sent an image]")
-                                    response, matched_product = handle_text_message(
-                                        f"image_url: {image_url}", 
-                                        "[Image attachment]"
-                                    )
-                                    send_message(sender_id, response)
-                                    if matched_product:
-                                        update_user_memory("facebook", sender_id, response)
-                                    image_processed = True
+                        image_urls = [
+                            attachment["payload"].get("url") for attachment in message_attachments
+                            if attachment.get("type") == "image" and attachment["payload"].get("url")
+                        ]
+                        if image_urls and not is_thumbs_up:
+                            for _ in image_urls:
+                                update_user_memory("facebook", sender_id, "[User sent an image]", role="user")
+                            # Acknowledge straight away; the match is sent when the image workers finish
+                            send_message(sender_id, IMAGE_ACK_REPLY)
+                            send_sender_action(sender_id, "typing_on")
+                            handle_image_attachments_deferred(
+                                image_urls, lambda replies, sender_id=sender_id: deliver_image_replies(sender_id, replies),
+                                "facebook", sender_id
+                            )
+                            image_processed = True
                     
                     if message_text and not image_processed:
-                        update_user_memory("facebook", sender_id, message_text)
-                        conversation_history = get_conversation_history("facebook", sender_id)
-                        full_message = f"Conversation so far:\n{conversation_history}\n\nUser: {message_text}"
-                        response, _ = handle_text_message(full_message, message_text)
-                        
-                        if " - http" in response and any(ext in response.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif']):
-                            try:
-                                image_url = response.split(" - ")[-1].strip()
-                                if image_url.startswith(('http://', 'https://')):
-                                    send_image(sender_id, image_url)
-                                    product_text = response.split(" - ")[0]
-                                    if product_text:
-                                        send_message(sender_id, product_text)
-                                        update_user_memory("facebook", sender_id, product_text)
-                            except Exception as e:
-                                logger.error(f"Error processing image URL: {str(e)}")
-                                send_message(sender_id, response)
-                                update_user_memory("facebook", sender_id, response)
-                        else:
-                            send_message(sender_id, response)
-                            update_user_memory("facebook", sender_id, response)
+                        update_user_memory("facebook", sender_id, message_text, role="user")
+                        send_sender_action(sender_id, "typing_on")
+
+                        # Send each sentence as soon as Gemini has produced it
+                        sent = []
+                        for sentence in iter_sentences(stream_text_message(message_text, message_text, "facebook", sender_id)):
+                            sent.append(send_reply(sender_id, sentence))
+                        response = "\n".join(part for part in sent if part)
+                        if response:
+                            update_user_memory("facebook", sender_id, response, role="model")
                     elif not image_processed:
                         send_message(sender_id, "👍")
 
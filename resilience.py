@@ -0,0 +1,217 @@
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT = "rate_limit"
+TRANSIENT = "transient"
+FATAL = "fatal"
+
+RATE_LIMIT_NAMES = {"ResourceExhausted", "TooManyRequests", "RateLimitExceededException"}
+TRANSIENT_NAMES = {
+    "ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "GatewayTimeout", "BadGateway",
+    "Aborted", "Unknown", "RetryError", "ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout",
+    "ClientConnectionError", "ServerDisconnectedError", "TimeoutError",
+    # A rejected key is retried because the next attempt uses a different key from the pool
+    "PermissionDenied", "Unauthenticated",
+}
+FATAL_NAMES = {"InvalidArgument", "NotFound", "FailedPrecondition", "StopCandidateException", "BlockedPromptException"}
+
+# "Retry-After: 30s", "Please retry in 53.2s", and Gemini's protobuf text "retry_delay { seconds: 53 }"
+_retry_after_re = re.compile(
+    r"retry_delay\s*\{\s*seconds\s*:\s*(\d+(?:\.\d+)?)|retry(?:[ _-]?after|[ _]delay)?\D{0,20}?(\d+(?:\.\d+)?)\s*s",
+    re.IGNORECASE,
+)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the LLM while the circuit breaker is open"""
+
+def classify_error(error):
+    """Sort an exception into RATE_LIMIT, TRANSIENT or FATAL"""
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & RATE_LIMIT_NAMES:
+        return RATE_LIMIT
+    if names & FATAL_NAMES:
+        return FATAL
+    if names & TRANSIENT_NAMES:
+        return TRANSIENT
+    code = getattr(error, "code", None) or getattr(error, "status", None)
+    if code == 429:
+        return RATE_LIMIT
+    if isinstance(code, int) and 400 <= code < 500:
+        return FATAL
+    message = str(error).lower()
+    if "429" in message or "quota" in message or "rate limit" in message:
+        return RATE_LIMIT
+    if "api key not valid" in message or "api_key_invalid" in message:
+        return TRANSIENT
+    return TRANSIENT
+
+def retry_after(error):
+    """Server-suggested wait in seconds, if the error carries one"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After") if hasattr(headers, "get") else None
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    match = _retry_after_re.search(str(error))
+    return float(match.group(1) or match.group(2)) if match else None
+
+class CircuitBreaker:
+    """Opens when the recent error rate spikes, then lets a single trial call through after a cooldown"""
+
+    def __init__(self, window=20, min_calls=6, failure_rate=0.5, cooldown=30):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self._results = deque(maxlen=window)
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._results.append(True)
+            if self._opened_at is not None:
+                logger.info("Circuit breaker closed after a successful trial call")
+            self._opened_at = None
+            self._trial_running = False
+
+    def release(self):
+        """End a call without a verdict (cancelled, or failed for reasons of its own) so the next trial can run"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._results.append(False)
+            if self._opened_at is not None:
+                # Failed trial call: stay open for another cooldown
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+                return
+            failures = self._results.count(False)
+            if len(self._results) >= self.min_calls and failures / len(self._results) >= self.failure_rate:
+                self._opened_at = time.monotonic()
+                logger.warning(f"Circuit breaker opened: {failures}/{len(self._results)} recent LLM calls failed")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self._state(),
+                "recent_calls": len(self._results),
+                "recent_failures": self._results.count(False),
+            }
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, honouring retry-after hints"""
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0, max_retry_after=10.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def delay(self, attempt, error):
+        hint = retry_after(error)
+        if hint is not None:
+            # A customer is waiting: don't honour hints longer than we are willing to block
+            return min(hint, self.max_retry_after)
+        ceiling = min(self.max_delay, self.base_delay * (2 ** attempt))
+        if classify_error(error) == RATE_LIMIT:
+            ceiling = min(self.max_delay, ceiling * 2)
+        return random.uniform(0, ceiling)
+
+    def should_retry(self, attempt, error):
+        return attempt < self.max_attempts - 1 and classify_error(error) != FATAL
+
+def _record_error(breaker, error):
+    # Blocked prompts and bad requests say nothing about the service's health; outages and exhausted quota do
+    if classify_error(error) != FATAL:
+        breaker.record_failure()
+    else:
+        breaker.release()
+
+def call_with_retry(func, policy, breaker, on_error=None):
+    """Run func(attempt) under the retry policy and circuit breaker"""
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        try:
+            result = func(attempt)
+        except Exception as e:
+            _record_error(breaker, e)
+            if on_error:
+                on_error(e, attempt)
+            if not policy.should_retry(attempt, e):
+                raise
+            time.sleep(policy.delay(attempt, e))
+            attempt += 1
+            continue
+        except BaseException:
+            # Cancelled or interrupted: a half-open trial must not stay claimed forever
+            breaker.release()
+            raise
+        breaker.record_success()
+        return result
+
+async def call_with_retry_async(func, policy, breaker, on_error=None):
+    """Async variant of call_with_retry; func(attempt) returns an awaitable"""
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        try:
+            result = await func(attempt)
+        except Exception as e:
+            _record_error(breaker, e)
+            if on_error:
+                on_error(e, attempt)
+            if not policy.should_retry(attempt, e):
+                raise
+            await asyncio.sleep(policy.delay(attempt, e))
+            attempt += 1
+            continue
+        except BaseException:
+            # Cancelled or interrupted: a half-open trial must not stay claimed forever
+            breaker.release()
+            raise
+        breaker.record_success()
+        return result
@@ -0,0 +1,125 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+from catalog_index import BANGLA_DIGITS
+
+MAX_ENTRIES = 1000
+TTL = 30 * 60  # seconds
+MAX_MESSAGE_LENGTH = 120  # long messages are rarely repeated word for word
+
+# Replies to these depend on what was said before, so the same words can need a different answer
+CONTEXT_WORDS = {
+    "it", "this", "that", "these", "those", "them", "same", "one", "yes", "no", "ok", "okay",
+    "sure", "again", "more", "another", "eta", "oita", "ota", "hae", "ha", "na", "accha",
+    "এটা", "ওটা", "এইটা", "ওইটা", "হ্যাঁ", "না", "আচ্ছা", "ঠিক",
+}
+# Messages that move an order forward or ask about one are never answered from cache
+ORDER_WORDS = {
+    "order", "confirm", "buy", "book", "kinbo", "nibo", "nite", "chai", "status", "track",
+    "transaction", "txn", "trx", "address", "name", "mobile",
+    "অর্ডার", "কিনব", "নিব", "নিতে", "চাই", "ঠিকানা", "নাম",
+}
+# Words that ask about some product without naming it: "price?", "dam koto?", "size?", "available?".
+# A message made only of these refers to whatever was discussed before, so its answer is customer-specific.
+ELLIPTICAL_WORDS = {
+    "price", "prices", "cost", "dam", "daam", "koto", "how", "much", "what", "which", "size", "sizes",
+    "color", "colors", "colour", "colours", "available", "availability", "stock", "in", "is", "are",
+    "the", "of", "there", "any", "do", "you", "have", "has", "pic", "pics", "picture", "image", "photo",
+    "details", "detail", "discount", "offer", "quality", "ache", "ase", "achhe", "ki", "kemon", "er", "r",
+    "দাম", "কত", "সাইজ", "কালার", "রং", "আছে", "কি", "ছবি", "কেমন",
+}
+MIN_WORDS = 2  # a single word is almost always a follow-up
+# Cues in recent history that an order is being collected
+ORDER_IN_PROGRESS = ("mobile", "address", "transaction id", "payment method", "ঠিকানা", "মোবাইল")
+
+# \w alone splits Bangla words at vowel signs, so the Bengali block is included explicitly
+_word_re = re.compile(r"[\w\u0980-\u09FF]+", re.UNICODE)
+_digits_re = re.compile(r"\d{6,}")
+
+def normalize(message):
+    return " ".join(_word_re.findall(str(message).lower().translate(BANGLA_DIGITS)))
+
+def is_cacheable_message(message, history=""):
+    """True for standalone FAQ-style questions whose answer depends only on catalog and settings"""
+    if not message or message.startswith("[") or len(message) > MAX_MESSAGE_LENGTH:
+        return False
+    normalized = normalize(message)
+    words = set(normalized.split())
+    if not words or words & CONTEXT_WORDS or words & ORDER_WORDS:
+        return False
+    if len(normalized.split()) < MIN_WORDS or words <= ELLIPTICAL_WORDS:
+        return False
+    if _digits_re.search(normalized):  # phone numbers, transaction IDs
+        return False
+    history = history.lower()
+    return not any(cue in history for cue in ORDER_IN_PROGRESS)
+
+class ResponseCache:
+    """LRU + TTL cache of LLM replies keyed on the normalized message and the catalog/settings version"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        # Any catalog or settings change makes every cached answer suspect
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+
+    def get(self, message, history, version):
+        if not is_cacheable_message(message, history):
+            with self._lock:
+                self.skipped += 1
+            return None
+        key = normalize(message)
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, message, history, version, response):
+        if not is_cacheable_message(message, history) or "Your order has been placed!" in response:
+            return
+        key = normalize(message)
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (time.monotonic(), response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "skipped": self.skipped,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+response_cache = ResponseCache()
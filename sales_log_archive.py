@@ -0,0 +1,150 @@
+import os
+import re
+import ast
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("SALES_LOG_DIR", "saleslogs")
+SINGLE_FILE_PATH = "saleslogs.jsonl"  # the archive before it was split by month
+UNDATED = "0000-00"  # partition for logs without a date; sorts first, so retention drops it first
+FORMAT = "aifebrica-saleslogs"
+FORMAT_VERSION = 1
+
+def header_line():
+    return json.dumps({"format": FORMAT, "version": FORMAT_VERSION})
+
+def encode(log):
+    """One JSON line for a sales log; the store id is left out since it is local to each database"""
+    return json.dumps({k: v for k, v in log.items() if k != "id"}, ensure_ascii=False, separators=(",", ":"))
+
+def partition_of(log):
+    """Month a sales log belongs to, as YYYY-MM"""
+    date = str(log.get("date") or "")
+    return date[:7] if re.match(r"\d{4}-\d{2}", date) else UNDATED
+
+def iter_logs(lines):
+    """Stream sales logs from JSON Lines: a format header, then one log per line"""
+    lines = iter(lines)
+    for line in lines:
+        if line.strip():
+            header = json.loads(line)
+            if header.get("format") != FORMAT or header.get("version", 0) > FORMAT_VERSION:
+                raise ValueError(f"Unsupported sales log format: {line.strip()}")
+            break
+    for number, line in enumerate(lines, 2):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Most likely the last line of a write cut short by a crash
+            logger.error(f"Skipping unreadable sales log on line {number}")
+
+def iter_legacy_logs(lines):
+    """Stream sales logs from the old one-dict-repr-per-line file, as literals only"""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            log = ast.literal_eval(line.strip())
+        except (ValueError, SyntaxError):
+            logger.error(f"Skipping unreadable legacy sales log: {line.strip()[:80]}")
+            continue
+        if isinstance(log, dict):
+            yield log
+
+class SalesLogArchive:
+    """Sales logs as one append-only JSON Lines segment per month; retention drops whole segments"""
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, partition):
+        return os.path.join(self.directory, f"{partition}.jsonl")
+
+    def partitions(self):
+        """Months with a segment on disk, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-len(".jsonl")] for name in os.listdir(self.directory) if name.endswith(".jsonl"))
+
+    def exists(self):
+        return bool(self.partitions())
+
+    def append(self, log):
+        """Add one log to the end of its month's segment; returns the partition"""
+        partition = partition_of(log)
+        path = self._path(partition)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            new = not os.path.exists(path) or os.path.getsize(path) == 0
+            torn = False
+            if not new:
+                with open(path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b"\n"
+            with open(path, "a", encoding="utf-8") as f:
+                if new:
+                    f.write(header_line() + "\n")
+                elif torn:
+                    # Close off a line left unfinished by a crash so this log starts on its own line
+                    f.write("\n")
+                f.write(encode(log) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        return partition
+
+    def rewrite(self, logs):
+        """Replace every segment with logs; write then rename so readers never see half a segment"""
+        by_partition = {}
+        for log in logs:
+            by_partition.setdefault(partition_of(log), []).append(log)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for partition, entries in by_partition.items():
+                path = self._path(partition)
+                with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                    f.write(header_line() + "\n")
+                    for log in entries:
+                        f.write(encode(log) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(f"{path}.tmp", path)
+        for partition in set(self.partitions()) - set(by_partition):
+            os.remove(self._path(partition))
+        return sorted(by_partition)
+
+    def read(self, start=None, end=None):
+        """Stream logs dated from start to end (YYYY-MM-DD, inclusive), opening only the segments for those months"""
+        for partition in self.partitions():
+            if (start and partition < start[:7]) or (end and partition > end[:7]):
+                continue
+            with open(self._path(partition), encoding="utf-8") as f:
+                for log in iter_logs(f):
+                    date = str(log.get("date") or "")
+                    if (start and date < start) or (end and date > end):
+                        continue
+                    yield log
+
+    def drop_before(self, date):
+        """Delete the segments of months entirely before date; returns the partitions dropped"""
+        dropped = [partition for partition in self.partitions() if partition < date[:7]]
+        with self._lock:
+            for partition in dropped:
+                os.remove(self._path(partition))
+        return dropped
+
+    def text(self, partition):
+        """One segment as text, for the GitHub backup"""
+        with self._lock:
+            path = self._path(partition)
+            if not os.path.exists(path):
+                return header_line() + "\n"
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+
+sales_log_archive = SalesLogArchive()
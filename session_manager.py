@@ -0,0 +1,150 @@
+import os
+import time
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from conversation_window import ConversationSummary, HISTORY_TOKEN_BUDGET, split_window, clip
+
+MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", "1000"))
+IDLE_TIMEOUT = int(os.getenv("CHAT_IDLE_TIMEOUT", "1800"))  # seconds
+MAX_TOTAL_CHARS = int(os.getenv("CHAT_MAX_TOTAL_CHARS", "20000000"))  # ~20 MB of text across all sessions
+INSTRUCTION_ACK = "Understood. I will follow these instructions."
+
+class ChatSession:
+    """Structured multi-turn history for one (platform, user_id), with the system instruction as the first turn"""
+
+    def __init__(self, instruction, instruction_version, turns, summary=None, owner=None):
+        self.owner = owner  # (platform, user_id)
+        self.instruction = instruction
+        self.instruction_version = instruction_version
+        self.summary = summary or ConversationSummary()
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self._turns = []
+        for turn in turns:
+            self._append(turn["role"], turn["text"], turn.get("ts"))
+
+    def _append(self, role, text, ts=None):
+        if not text:
+            return
+        ts = ts or datetime.now().isoformat()
+        if self._turns and self._turns[-1]["role"] == role:
+            # Gemini expects alternating roles; merge consecutive messages from the same side
+            self._turns[-1] = {"role": role, "text": f"{self._turns[-1]['text']}\n{text}", "ts": ts}
+        else:
+            self._turns.append({"role": role, "text": text, "ts": ts})
+
+    def set_instruction(self, instruction, instruction_version):
+        with self.lock:
+            self.instruction = instruction
+            self.instruction_version = instruction_version
+
+    def prepare(self, prompt):
+        """History to start a Gemini chat from and the message to send with it"""
+        with self.lock:
+            self.last_used = time.monotonic()
+            turns = list(self._turns)
+            instruction = self.instruction
+        if turns and turns[-1]["role"] == "user":
+            # A user turn without a reply (e.g. an image) would break role alternation; send it with this one
+            prompt = f"{turns.pop()['text']}\n{prompt}"
+        history = [
+            {"role": "user", "parts": [instruction]},
+            {"role": "model", "parts": [INSTRUCTION_ACK]},
+        ]
+        history.extend({"role": t["role"], "parts": [clip(t["text"])]} for t in turns)
+        return history, prompt
+
+    def add_turn(self, user_text, reply):
+        """Record a completed exchange; only the plain message is kept, not the per-turn context"""
+        with self.lock:
+            self._append("user", user_text)
+            self._append("model", reply)
+            self.last_used = time.monotonic()
+
+    def compact(self, budget=HISTORY_TOKEN_BUDGET):
+        """Drop the turns that no longer fit the token budget and return them for summarizing"""
+        with self.lock:
+            older, self._turns = split_window(self._turns, budget)
+        return older
+
+    def recent_text(self, lines):
+        """Last few lines of the conversation, used to rank products and look up orders"""
+        with self.lock:
+            text = "\n".join(t["text"] for t in self._turns[-lines:])
+        return "\n".join(text.splitlines()[-lines:])
+
+    def chars(self):
+        with self.lock:
+            return len(self.instruction) + sum(len(t["text"]) for t in self._turns)
+
+class ChatSessionManager:
+    """LRU of live chat sessions with idle-timeout eviction and a cap on total history size"""
+
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_timeout=IDLE_TIMEOUT, max_total_chars=MAX_TOTAL_CHARS):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_total_chars = max_total_chars
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.rebuilds = 0
+        self.evictions = 0
+
+    def get(self, platform, user_id, instruction, instruction_version, load_turns, load_summary=None):
+        """Return the live session, rebuilding it from stored memory on a miss"""
+        key = (platform, str(user_id))
+        with self._lock:
+            session = self._sessions.get(key)
+            if session and time.monotonic() - session.last_used > self.idle_timeout:
+                del self._sessions[key]
+                self.evictions += 1
+                session = None
+            if session:
+                self._sessions.move_to_end(key)
+                self.hits += 1
+
+        if session is None:
+            summary = load_summary() if load_summary else None
+            turns = load_turns()
+            if summary and summary.covered_until:
+                # Turns already folded into the summary are not replayed; the window opens on a customer turn
+                turns = [t for t in turns if (t.get("ts") or "") > summary.covered_until]
+                while turns and turns[0]["role"] == "model":
+                    turns.pop(0)
+            session = ChatSession(instruction(), instruction_version, turns, summary, key)
+            with self._lock:
+                # Another message from the same user may have rebuilt it meanwhile; keep the first
+                session = self._sessions.setdefault(key, session)
+                self._sessions.move_to_end(key)
+                self.rebuilds += 1
+            self._evict()
+        elif session.instruction_version != instruction_version:
+            session.set_instruction(instruction(), instruction_version)
+        return session
+
+    def _evict(self):
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, s in self._sessions.items() if now - s.last_used > self.idle_timeout]:
+                del self._sessions[key]
+                self.evictions += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+            total = sum(s.chars() for s in self._sessions.values())
+            while total > self.max_total_chars and len(self._sessions) > 1:
+                _, session = self._sessions.popitem(last=False)
+                total -= session.chars()
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "hits": self.hits,
+                "rebuilds": self.rebuilds,
+                "evictions": self.evictions,
+            }
+
+session_manager = ChatSessionManager()
@@ -0,0 +1,204 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("STORE_DB_PATH", "aifebrica.db")
+BUSY_TIMEOUT_MS = 5000  # how long a writer waits for another writer's lock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_position ON products (position);
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_status ON orders (status);
+CREATE TABLE IF NOT EXISTS sales_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT,
+    status TEXT,
+    product TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sales_logs_date ON sales_logs (date);
+"""
+
+def _row_dict(row_id, data):
+    record = json.loads(data)
+    record["id"] = row_id
+    return record
+
+def _encode(record):
+    return json.dumps({k: v for k, v in record.items() if k != "id"}, ensure_ascii=False)
+
+class Store:
+    """SQLite store for orders, products, settings and sales logs; WAL mode, one connection per thread"""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            # WAL lets readers keep going while an order is being written
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Connection inside BEGIN IMMEDIATE; commits on success, rolls back on error"""
+        conn = self._connect()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def imported(self, name):
+        """Whether import_once has stored name"""
+        return self._connect().execute("SELECT 1 FROM meta WHERE key = ?", (f"imported:{name}",)).fetchone() is not None
+
+    def import_once(self, name, load):
+        """Run load() and store what it returns the first time only; later runs are no-ops. True if it ran"""
+        marker = f"imported:{name}"
+        if self.imported(name):
+            return False
+        data = load()
+        with self.transaction() as conn:
+            # Another process may have imported while load() ran
+            if conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                return False
+            {
+                "settings": self._put_settings,
+                "products": self._put_products,
+                "orders": self._put_orders,
+                "sales_logs": self._put_sales_logs,
+            }[name](conn, data)
+            conn.execute("INSERT INTO meta (key, value) VALUES (?, datetime('now'))", (marker,))
+        logger.info(f"Imported {name} into {self.path}")
+        return True
+
+    # Settings
+
+    def _put_settings(self, conn, settings):
+        conn.executemany(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            [(key, json.dumps(value, ensure_ascii=False)) for key, value in settings.items()],
+        )
+
+    def load_settings(self):
+        rows = self._connect().execute("SELECT key, value FROM settings")
+        return {key: json.loads(value) for key, value in rows}
+
+    def save_settings(self, settings):
+        with self.transaction() as conn:
+            self._put_settings(conn, settings)
+
+    # Products, kept in catalog order by position
+
+    def _put_products(self, conn, products):
+        conn.executemany(
+            "INSERT INTO products (position, data) VALUES (?, ?)",
+            [(position, _encode(product)) for position, product in enumerate(products)],
+        )
+
+    def load_products(self):
+        rows = self._connect().execute("SELECT data FROM products ORDER BY position")
+        return [json.loads(data) for data, in rows]
+
+    def insert_product(self, position, product):
+        with self.transaction() as conn:
+            conn.execute("UPDATE products SET position = position + 1 WHERE position >= ?", (position,))
+            conn.execute("INSERT INTO products (position, data) VALUES (?, ?)", (position, _encode(product)))
+
+    def update_product(self, position, product):
+        with self.transaction() as conn:
+            conn.execute("UPDATE products SET data = ? WHERE position = ?", (_encode(product), position))
+
+    def delete_product(self, position):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM products WHERE position = ?", (position,))
+            conn.execute("UPDATE products SET position = position - 1 WHERE position > ?", (position,))
+
+    # Orders
+
+    def _put_orders(self, conn, orders):
+        for order in orders:
+            self._insert_order(conn, order)
+
+    def _insert_order(self, conn, order):
+        cursor = conn.execute("INSERT INTO orders (status, data) VALUES (?, ?)", (order.get("status"), _encode(order)))
+        return cursor.lastrowid
+
+    def load_orders(self):
+        rows = self._connect().execute("SELECT id, data FROM orders ORDER BY id")
+        return [_row_dict(row_id, data) for row_id, data in rows]
+
+    def insert_order(self, order):
+        """Store a new order and return its id"""
+        with self.transaction() as conn:
+            return self._insert_order(conn, order)
+
+    def update_order(self, order):
+        with self.transaction() as conn:
+            conn.execute("UPDATE orders SET status = ?, data = ? WHERE id = ?", (order.get("status"), _encode(order), order["id"]))
+
+    def close_order(self, order, archive=None):
+        """Move a finished order to the sales logs in one transaction; returns the sales log id. If archive(order) fails, nothing is committed"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM orders WHERE id = ?", (order["id"],))
+            log_id = self._insert_sales_log(conn, order)
+            if archive:
+                archive(order)
+            return log_id
+
+    # Sales logs
+
+    def _put_sales_logs(self, conn, logs):
+        for log in logs:
+            self._insert_sales_log(conn, log)
+
+    def _insert_sales_log(self, conn, log):
+        cursor = conn.execute(
+            "INSERT INTO sales_logs (date, status, product, data) VALUES (?, ?, ?, ?)",
+            (log.get("date"), log.get("status"), log.get("product"), _encode(log)),
+        )
+        return cursor.lastrowid
+
+    def load_sales_logs(self, since=None):
+        """Sales logs in insertion order; only those dated since (YYYY-MM-DD) onwards when given"""
+        if since is None:
+            rows = self._connect().execute("SELECT id, data FROM sales_logs ORDER BY id")
+        else:
+            rows = self._connect().execute("SELECT id, data FROM sales_logs WHERE date >= ? ORDER BY id", (since,))
+        return [_row_dict(row_id, data) for row_id, data in rows]
+
+    def delete_sales_logs_before(self, date):
+        """Drop sales logs dated before date (YYYY-MM-DD); returns how many went"""
+        with self.transaction() as conn:
+            return conn.execute("DELETE FROM sales_logs WHERE date < ? OR date IS NULL", (date,)).rowcount
+
+store = Store()
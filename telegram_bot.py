@@ -1,12 +1,17 @@
 import os
+import asyncio
 import logging
 from telegram import Update, InputFile
+from telegram.constants import ChatAction
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from messageHandler import handle_text_message
+from messageHandler import handle_image_attachments_async, stream_text_message_async, IMAGE_ACK_REPLY
 from dotenv import load_dotenv
-import requests
+import async_http
+from image_loader import MAX_IMAGE_BYTES
 from io import BytesIO
-from memory_manager import update_user_memory, get_conversation_history
+from memory_manager import update_user_memory
+from chat_locks import chat_locks
+from bot_replies import ERROR_TEXT, has_product_image, split_product_image, stream_reply
 
 # Load environment variables
 load_dotenv()
@@ -21,6 +26,25 @@ logger = logging.getLogger(__name__)
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_ADMIN_ID = os.getenv("TELEGRAM_ADMIN_ID")
 
+async def reply_with_product_image(message, response):
+    """Reply with the product photo and caption for a "[Product] - [Image URL]" response"""
+    try:
+        product_text, image_url = split_product_image(response)
+        
+        # Download image without blocking the event loop
+        image_bytes = await async_http.fetch_bytes(image_url, max_bytes=MAX_IMAGE_BYTES)
+        if image_bytes:
+            # Send image
+            await message.reply_photo(
+                photo=BytesIO(image_bytes),
+                caption=product_text
+            )
+        else:
+            await message.reply_text(response)
+    except Exception as e:
+        logger.error(f"Error processing image URL: {str(e)}")
+        await message.reply_text(response)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
     await update.message.reply_text('Hi! I am your shop assistant. How can I help you today?')
@@ -30,14 +54,18 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text('I can help you with product inquiries and orders. Just send me a message!')
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle incoming messages."""
+    """Handle incoming messages; updates run concurrently, but each chat's messages are answered in order"""
+    async with chat_locks.get("telegram", update.message.from_user.id):
+        await _handle_message(update, context)
+
+async def _handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = str(update.message.from_user.id)
         message_text = update.message.text if update.message.text else ""
         
         # Save user message to memory first
         if message_text:
-            update_user_memory("telegram", user_id, message_text)
+            await asyncio.to_thread(update_user_memory, "telegram", user_id, message_text, "user")
             
         # Handle photo attachments
         if update.message.photo:
@@ -46,81 +74,51 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             image_url = photo_file.file_path
             logger.info(f"Received image with URL: {image_url}")
             
-            # Format the image URL for processing
-            formatted_image_url = f"image_url: {image_url}"
-            update_user_memory("telegram", user_id, "[User sent an image]")
+            await asyncio.to_thread(update_user_memory, "telegram", user_id, "[User sent an image]", "user")
             
-            # Process the image directly through messageHandler
-            response, matched_product = handle_text_message(formatted_image_url, "[Image attachment]")
+            # Acknowledge straight away; matching runs in the image worker pool while other chats are served
+            await update.message.reply_text(IMAGE_ACK_REPLY)
+            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
+            response, matched_product = (await handle_image_attachments_async([image_url], "telegram", user_id))[0]
             logger.info(f"Image processing response: {response}")
             
             if matched_product:
-                update_user_memory("telegram", user_id, response)
+                await asyncio.to_thread(update_user_memory, "telegram", user_id, response, "model")
             
             # Send the response
-            if " - http" in response and any(ext in response.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif']):
-                try:
-                    product_text = response.split(" - ")[0]
-                    image_url = response.split(" - ")[-1].strip()
-                    
-                    # Download image
-                    image_response = requests.get(image_url)
-                    if image_response.status_code == 200:
-                        # Send image
-                        await update.message.reply_photo(
-                            photo=BytesIO(image_response.content),
-                            caption=product_text
-                        )
-                    else:
-                        await update.message.reply_text(response)
-                except Exception as e:
-                    logger.error(f"Error processing image URL: {str(e)}")
-                    await update.message.reply_text(response)
+            if has_product_image(response):
+                await reply_with_product_image(update.message, response)
             else:
                 await update.message.reply_text(response)
             return
                 
-        # Get conversation history
-        conversation_history = get_conversation_history("telegram", user_id)
-        full_message = f"Conversation so far:\n{conversation_history}\n\nUser: {message_text}"
+        # Earlier turns come from the user's live chat session
+        # Show typing straight away and stream the reply into a single, progressively edited message
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
+        sent, response = await stream_reply(
+            stream_text_message_async(message_text, message_text, "telegram", user_id),
+            update.message.reply_text, lambda sent, text: sent.edit_text(text)
+        )
         
-        # Process the message through your existing handler
-        response, matched_product = handle_text_message(full_message, message_text)
-        
-        # Update memory with the response if it's not an image
-        if not (" - http" in response and any(ext in response.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif'])):
-            update_user_memory("telegram", user_id, response)
-        
-        # Check if response contains an image URL
-        if " - http" in response and any(ext in response.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif']):
-            try:
-                product_text = response.split(" - ")[0]
-                image_url = response.split(" - ")[-1].strip()
-                
-                # Download image
-                image_response = requests.get(image_url)
-                if image_response.status_code == 200:
-                    # Send image
-                    await update.message.reply_photo(
-                        photo=BytesIO(image_response.content),
-                        caption=product_text
-                    )
-                else:
-                    await update.message.reply_text(response)
-            except Exception as e:
-                logger.error(f"Error processing image URL: {str(e)}")
-                await update.message.reply_text(response)
+        # Swap the streamed text for the product photo when the reply links one
+        if has_product_image(response):
+            await sent.delete()
+            await reply_with_product_image(update.message, response)
         else:
-            await update.message.reply_text(response)
+            await asyncio.to_thread(update_user_memory, "telegram", user_id, response, "model")
             
     except Exception as e:
         logger.error(f"Error in handle_message: {str(e)}")
-        await update.message.reply_text("Sorry, I encountered an error processing your message.")
+        await update.message.reply_text(ERROR_TEXT)
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Log errors."""
     logger.error(f'Update {update} caused error {context.error}')
 
+async def post_shutdown(application):
+    # The aiohttp session used for product photo downloads belongs to this event loop
+    await async_http.close_session()
+
 def main():
     """Start the bot."""
     if not TELEGRAM_TOKEN:
@@ -128,7 +126,8 @@ def main():
         return
     
     # Create the Application
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    # Handle updates concurrently so one slow conversation doesn't hold up the others
+    application = Application.builder().token(TELEGRAM_TOKEN).concurrent_updates(True).post_shutdown(post_shutdown).build()
 
     # Add handlers
     application.add_handler(CommandHandler("start", start))
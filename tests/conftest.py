@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Module-level singletons must not write into the working tree during tests
+os.environ.setdefault("STORE_DB_PATH", os.path.join(tempfile.mkdtemp(), "store.db"))
+os.environ.setdefault("SALES_LOG_DIR", os.path.join(tempfile.mkdtemp(), "saleslogs"))
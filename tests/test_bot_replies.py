@@ -0,0 +1,36 @@
+import asyncio
+from bot_replies import has_product_image, split_product_image, stream_reply
+
+class FakeMessage:
+    def __init__(self, text):
+        self.edits = [text]
+
+def run_stream(chunks):
+    async def source():
+        for chunk in chunks:
+            yield chunk
+
+    async def send(text):
+        return FakeMessage(text)
+
+    async def edit(message, text):
+        # Like Telegram: an edit that leaves the trimmed text unchanged is an error
+        assert text.strip() != message.edits[-1].strip(), "Message is not modified"
+        message.edits.append(text)
+
+    return asyncio.run(stream_reply(source(), send, edit, interval=0))
+
+def test_reply_ending_in_whitespace_is_not_edited_again():
+    sent, text = run_stream(["Yes, we have it in stock.\n"])
+    assert text == "Yes, we have it in stock."
+    assert sent.edits == ["Yes, we have it in stock.\n"]
+
+def test_streamed_text_is_edited_in_as_it_grows():
+    sent, text = run_stream(["Cargo Pant ", "is 950৳.", "\n"])
+    assert text == "Cargo Pant is 950৳."
+    assert [e.strip() for e in sent.edits] == ["Cargo Pant", "Cargo Pant is 950৳."]
+
+def test_product_image_reply_is_split_into_caption_and_url():
+    response = "Cargo Pant (Pants) - https://example.com/cargo.jpg"
+    assert has_product_image(response)
+    assert split_product_image(response) == ("Cargo Pant (Pants)", "https://example.com/cargo.jpg")
@@ -0,0 +1,23 @@
+import pytest
+from catalog_index import CatalogIndex, parse_price_range
+
+@pytest.mark.parametrize("text, expected", [
+    ("shoes size 38-40", (None, None)),
+    ("do you have 38-40 shoes", (None, None)),
+    ("shoes 38-40 under 2000", (None, 2000)),
+    ("shirt 500-900", (500, 900)),
+    ("price 40-50 er moddhe kichu ache?", (40, 50)),
+    ("between 30 and 50", (30, 50)),
+    ("৫০০ থেকে ৯০০ টাকা", (500, 900)),
+    ("size 42 panjabi 1200-1500 tk", (1200, 1500)),
+])
+def test_parse_price_range(text, expected):
+    assert parse_price_range(text) == expected
+
+def test_size_range_does_not_filter_products_by_price():
+    index = CatalogIndex([
+        {"type": "Sneakers", "category": "Shoes", "size": ["38", "39", "40"], "price": 1800},
+        {"type": "T-Shirt", "category": "Tops", "size": ["M", "L"], "price": 450},
+    ])
+
+    assert [p["type"] for p in index.search("shoes size 38-40")] == ["Sneakers"]
@@ -0,0 +1,19 @@
+import asyncio
+from chat_locks import ChatLocks
+
+def test_messages_from_one_chat_are_handled_in_order():
+    locks = ChatLocks()
+    events = []
+
+    async def handle(user_id, text, delay):
+        async with locks.get("telegram", user_id):
+            events.append(f"start {text}")
+            await asyncio.sleep(delay)
+            events.append(f"end {text}")
+
+    async def main():
+        await asyncio.gather(handle(1, "first", 0.02), handle(1, "second", 0), handle(2, "other", 0))
+
+    asyncio.run(main())
+    assert events.index("end first") < events.index("start second")
+    assert events.index("start other") < events.index("end first")
@@ -0,0 +1,30 @@
+from io import BytesIO
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("numpy")
+pytest.importorskip("requests")
+
+from image_loader import decode_image
+
+def _encode(image, format):
+    buffer = BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+@pytest.mark.parametrize("mode", ["P", "1"])
+def test_large_palette_and_bilevel_images_are_reduced(mode):
+    image = Image.new("RGB", (1000, 1000), (200, 30, 30)).convert(mode)
+
+    pixels = decode_image(_encode(image, "PNG"), size=(250, 250))
+
+    assert pixels.shape == (250, 250, 3)
+
+def test_transparent_palette_image_is_flattened_onto_white():
+    image = Image.new("RGBA", (600, 600), (0, 0, 0, 0)).convert("P")
+    image.info["transparency"] = 0
+
+    pixels = decode_image(_encode(image, "PNG"), size=(250, 250))
+
+    assert pixels.shape == (300, 300, 3)
+    assert tuple(pixels[0, 0]) == (255, 255, 255)
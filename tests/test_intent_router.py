@@ -0,0 +1,36 @@
+import pytest
+from intent_router import IntentRouter
+
+PRODUCTS = [
+    {"type": "Cargo Pant", "category": "Pants", "price": 950, "size": ["30", "32"], "color": ["Khaki"]},
+    {"type": "Polo Shirt", "category": "Shirts", "price": 650, "size": ["M", "L"], "color": ["Navy"]},
+]
+SETTINGS = {
+    "currency": "৳",
+    "payment_methods": {"cod": True},
+    "delivery_records": [{"region": "Dhaka", "country": "Bangladesh", "delivery_charge": 60, "delivery_time": "2 days"}],
+}
+
+def route(message):
+    return IntentRouter().route(message, "", PRODUCTS, SETTINGS)
+
+def test_simple_price_question_is_answered_from_the_catalog():
+    assert route("how much is the cargo pant") == "Cargo Pant (Pants): 950৳"
+
+@pytest.mark.parametrize("message", [
+    "how much is the cargo pant with delivery to Chittagong",
+    "cargo pant and polo shirt price",
+    "cargo pant er dam ar delivery charge koto",
+    "i want to cancel, price of cargo pant",
+    "how much for 2 cargo pants",
+])
+def test_compound_questions_go_to_the_model(message):
+    assert route(message) is None
+
+@pytest.mark.parametrize("message", ["delivery charge koto", "how long does delivery take", "cash on delivery ache?"])
+def test_delivery_words_inside_a_delivery_or_payment_question_are_fine(message):
+    assert route(message) is not None
+
+def test_fillers_and_product_names_do_not_block_a_templated_answer():
+    assert route("polo shirt size?") == "Polo Shirt sizes: M, L"
+    assert route("ডেলিভারি চার্জ কত") is not None
@@ -0,0 +1,23 @@
+import pytest
+from order_index import OrderIndex, is_order_lookup
+
+@pytest.mark.parametrize("text", [
+    "I want to order the cargo pant",
+    "delivery charge koto?",
+    "kobe pabo delivery?",
+    "what's my order status",
+])
+def test_sales_turns_and_lookups_without_a_number_are_not_lookups(text):
+    assert not is_order_lookup(text)
+
+@pytest.mark.parametrize("text", [
+    "order status please, Rahim 01711111111",
+    "আমার অর্ডার কবে পাব? ০১৭১১১১১১১১",
+])
+def test_status_question_with_a_mobile_number_is_a_lookup(text):
+    assert is_order_lookup(text)
+
+def test_order_found_by_name_and_mobile_in_text():
+    index = OrderIndex([{"name": "Rahim Uddin", "mobile": "+8801711111111", "status": "Shipping"}])
+    assert [o["status"] for o in index.find_in_text("status? Rahim Uddin 01711-111111")] == ["Shipping"]
+    assert index.find_in_text("status? Karim 01711111111") == []
@@ -0,0 +1,52 @@
+from order_parser import OrderBlockFilter, OrderDeduplicator, extract_order, strip_order_block
+
+def stream(chunks):
+    block_filter = OrderBlockFilter()
+    return "".join(block_filter.feed(chunk) for chunk in chunks) + block_filter.flush()
+
+def test_text_after_the_order_block_is_streamed():
+    assert stream(["hello <order>{}</order> Thanks!"]) == "hello  Thanks!"
+
+def test_tags_split_across_chunks():
+    chunks = ["Your order has been placed! <or", 'der>{"name": "Rahim"', "}</ord", "er>\nThanks for shopping", " with us."]
+    assert stream(chunks) == "Your order has been placed! \nThanks for shopping with us."
+
+def test_streaming_matches_strip_order_block():
+    reply = 'Done. <order>{"name": "Rahim", "total": 980}</order>\nSee you soon!'
+    for size in (1, 3, 7, len(reply)):
+        chunks = [reply[i:i + size] for i in range(0, len(reply), size)]
+        assert stream(chunks).rstrip() == strip_order_block(reply)
+
+def test_unclosed_block_is_held_back():
+    assert stream(["hello <order>{\"name\": ", "\"Rahim\""]) == "hello "
+
+def test_text_that_only_looks_like_a_tag_is_released():
+    assert stream(["price < 900 and <or", "ange color"]) == "price < 900 and <orange color"
+
+CONFIRMATION = 'Your order has been placed! <order>{"name": "Rahim", "mobile": "01711111111", "product": "Cargo Pant", "price": 950}</order>'
+
+def test_same_reply_to_the_same_turn_is_recorded_once():
+    dedup = OrderDeduplicator()
+    turn = ("facebook", "42", "yes confirm")
+    assert dedup.claim(CONFIRMATION, turn)
+    assert not dedup.claim(CONFIRMATION, turn)
+
+def test_identical_order_in_a_later_turn_is_recorded_again():
+    dedup = OrderDeduplicator()
+    assert dedup.claim(CONFIRMATION, ("facebook", "42", "yes confirm"))
+    assert dedup.claim(CONFIRMATION, ("facebook", "42", "same again please, confirm"))
+    assert dedup.claim(CONFIRMATION, ("instagram", "7", "yes confirm"))
+
+def test_echoed_template_is_not_an_order():
+    template = 'Your order has been placed! <order>{"name": "...", "mobile": "...", "address": "...", "product": "...", "price": 0, "total": 0}</order>'
+    assert extract_order(template) is None
+
+def test_order_block_without_confirmation_is_not_an_order():
+    assert extract_order(CONFIRMATION.replace("Your order has been placed! ", "")) is None
+
+def test_short_mobile_is_rejected():
+    assert extract_order(CONFIRMATION.replace("01711111111", "01711")) is None
+
+def test_confirmed_order_is_extracted():
+    order = extract_order(CONFIRMATION)
+    assert (order["name"], order["mobile"], order["price"], order["status"]) == ("Rahim", "01711111111", 950, "Preparing")
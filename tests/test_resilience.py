@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, call_with_retry, call_with_retry_async, retry_after
+
+class BlockedPromptException(Exception):
+    pass
+
+class ServiceUnavailable(Exception):
+    pass
+
+def raising(error):
+    def func(attempt):
+        raise error
+    return func
+
+def test_blocked_prompts_do_not_open_the_breaker():
+    breaker = CircuitBreaker(window=20, min_calls=6, failure_rate=0.5)
+    for _ in range(10):
+        with pytest.raises(BlockedPromptException):
+            call_with_retry(raising(BlockedPromptException("blocked")), RetryPolicy(max_attempts=1), breaker)
+    assert breaker.state == "closed"
+
+def test_transient_failures_open_the_breaker():
+    breaker = CircuitBreaker(window=20, min_calls=6, failure_rate=0.5)
+    for _ in range(6):
+        with pytest.raises(ServiceUnavailable):
+            call_with_retry(raising(ServiceUnavailable("503")), RetryPolicy(max_attempts=1), breaker)
+    with pytest.raises(CircuitOpenError):
+        call_with_retry(lambda attempt: "ok", RetryPolicy(), breaker)
+
+def test_cancelled_trial_releases_the_half_open_breaker():
+    breaker = CircuitBreaker(min_calls=1, cooldown=0)
+    breaker.record_failure()
+    assert breaker.state == "half_open"
+
+    async def cancelled(attempt):
+        raise asyncio.CancelledError()
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(call_with_retry_async(cancelled, RetryPolicy(), breaker))
+    assert breaker.allow()
+
+def test_gemini_retry_delay_is_honoured():
+    error = Exception('429 Resource has been exhausted. [violations {\n}\n, retry_delay {\n  seconds: 53\n}\n]')
+    assert retry_after(error) == 53.0
+
+def test_plain_retry_hints_still_parse():
+    assert retry_after(Exception("Please retry in 12.5s")) == 12.5
+    assert retry_after(Exception("bad request")) is None
+
+class ResourceExhausted(Exception):
+    pass
+
+def test_repeated_rate_limits_open_the_breaker():
+    breaker = CircuitBreaker(window=20, min_calls=6, failure_rate=0.5)
+    for _ in range(6):
+        with pytest.raises(ResourceExhausted):
+            call_with_retry(raising(ResourceExhausted("429 quota exceeded")), RetryPolicy(max_attempts=1), breaker)
+    with pytest.raises(CircuitOpenError):
+        call_with_retry(lambda attempt: "ok", RetryPolicy(), breaker)
@@ -0,0 +1,15 @@
+import pytest
+from response_cache import ResponseCache, is_cacheable_message
+
+@pytest.mark.parametrize("message", ["price?", "dam koto?", "size?", "available?", "what sizes are available?", "দাম কত?"])
+def test_elliptical_follow_ups_are_not_cached(message):
+    assert not is_cacheable_message(message)
+
+@pytest.mark.parametrize("message", ["price of cargo pant?", "denim shirt dam koto", "what payment methods do you accept"])
+def test_questions_that_name_their_subject_are_cached(message):
+    assert is_cacheable_message(message)
+
+def test_follow_up_answer_is_not_served_to_another_customer():
+    cache = ResponseCache()
+    cache.put("price?", "Do you have the cargo pant?", 1, "The Cargo Pant is 850BDT.")
+    assert cache.get("price?", "Show me dress shoes", 1) is None
@@ -0,0 +1,84 @@
+import json
+import pytest
+from store import Store
+from order_backup import ORDERS_BACKUP_PATH, LEGACY_ORDERS_SOURCE, load_orders_backup
+
+def test_orders_restored_from_github_backup_into_empty_db(tmp_path):
+    store = Store(str(tmp_path / "store.db"))
+    backup = {ORDERS_BACKUP_PATH: json.dumps([{"id": 7, "name": "Rahim", "status": "Preparing", "total": 980}])}
+
+    assert store.import_once("orders", lambda: load_orders_backup(backup.get))
+
+    restored = store.load_orders()
+    assert [(o["name"], o["status"], o["total"]) for o in restored] == [("Rahim", "Preparing", 980)]
+    assert store.imported("orders")
+
+def test_orders_restored_from_legacy_source_when_there_is_no_backup(tmp_path):
+    store = Store(str(tmp_path / "store.db"))
+    source = (
+        "import os\n"
+        "# Orders List\n"
+        "orders = [\n"
+        "    {'name': 'Karim', 'mobile': '01700000000', 'status': 'Shipping'}\n"
+        "]\n"
+    )
+
+    store.import_once("orders", lambda: load_orders_backup({LEGACY_ORDERS_SOURCE: source}.get))
+
+    assert [o["name"] for o in store.load_orders()] == ["Karim"]
+
+def test_orders_import_runs_only_once(tmp_path):
+    store = Store(str(tmp_path / "store.db"))
+    backup = {ORDERS_BACKUP_PATH: json.dumps([{"name": "Rahim", "status": "Preparing"}])}
+    store.import_once("orders", lambda: load_orders_backup(backup.get))
+
+    assert not store.import_once("orders", lambda: load_orders_backup(backup.get))
+    assert len(store.load_orders()) == 1
+
+def test_failed_restore_is_retried(tmp_path):
+    store = Store(str(tmp_path / "store.db"))
+
+    def unreachable(path):
+        raise ConnectionError("GitHub is down")
+
+    try:
+        store.import_once("orders", lambda: load_orders_backup(unreachable))
+    except ConnectionError:
+        pass
+    assert not store.imported("orders")
+
+def test_closing_an_order_rolls_back_when_the_archive_append_fails(tmp_path):
+    store = Store(str(tmp_path / "store.db"))
+    order_id = store.insert_order({"name": "Rahim", "status": "Preparing", "total": 980})
+
+    def failing_archive(log):
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        store.close_order({"id": order_id, "name": "Rahim", "status": "Delivered", "total": 980}, archive=failing_archive)
+
+    assert [o["status"] for o in store.load_orders()] == ["Preparing"]
+    assert store.load_sales_logs() == []
+
+def test_closing_an_order_archives_it(tmp_path):
+    store = Store(str(tmp_path / "store.db"))
+    order_id = store.insert_order({"name": "Rahim", "status": "Preparing", "total": 980})
+    archived = []
+
+    store.close_order({"id": order_id, "name": "Rahim", "status": "Delivered", "total": 980}, archive=archived.append)
+
+    assert store.load_orders() == []
+    assert [log["status"] for log in store.load_sales_logs()] == ["Delivered"]
+    assert [log["status"] for log in archived] == ["Delivered"]
+
+def test_sales_logs_can_be_loaded_from_a_date_onwards(tmp_path):
+    store = Store(str(tmp_path / "store.db"))
+    store.import_once("sales_logs", lambda: [
+        {"date": "2026-06-30", "status": "Delivered"},
+        {"date": "2026-08-01", "status": "Canceled"},
+        {"status": "Delivered"},
+        {"date": "2026-09-15", "status": "Delivered"},
+    ])
+
+    assert [log["date"] for log in store.load_sales_logs(since="2026-08-01")] == ["2026-08-01", "2026-09-15"]
+    assert len(store.load_sales_logs()) == 4
@@ -0,0 +1,113 @@
+import math
+import threading
+from datetime import datetime
+from collections import OrderedDict, deque
+
+MAX_USERS = 500  # users kept in the per-user breakdown, least recently active dropped first
+MAX_HOURS = 48  # hourly buckets kept
+
+def estimate_tokens(text):
+    """Rough Gemini token estimate: ~4 bytes per token, so Bangla text counts heavier than English"""
+    if not text:
+        return 0
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
+def _empty_bucket():
+    return {
+        "calls": 0,
+        "prompt_chars": 0,
+        "prompt_tokens": 0,
+        "output_tokens": 0,
+        "latency_ms": 0.0,
+        "max_prompt_tokens": 0,
+        "sections": {},
+    }
+
+def _add(bucket, record):
+    bucket["calls"] += 1
+    bucket["prompt_chars"] += record["prompt_chars"]
+    bucket["prompt_tokens"] += record["prompt_tokens"]
+    bucket["output_tokens"] += record["output_tokens"]
+    bucket["latency_ms"] += record["latency_ms"]
+    bucket["max_prompt_tokens"] = max(bucket["max_prompt_tokens"], record["prompt_tokens"])
+    for name, tokens in record["section_tokens"].items():
+        bucket["sections"][name] = bucket["sections"].get(name, 0) + tokens
+
+def _summarize(bucket):
+    calls = bucket["calls"] or 1
+    return {
+        "calls": bucket["calls"],
+        "prompt_chars": bucket["prompt_chars"],
+        "prompt_tokens": bucket["prompt_tokens"],
+        "output_tokens": bucket["output_tokens"],
+        "avg_prompt_tokens": round(bucket["prompt_tokens"] / calls),
+        "avg_output_tokens": round(bucket["output_tokens"] / calls),
+        "avg_latency_ms": round(bucket["latency_ms"] / calls),
+        "max_prompt_tokens": bucket["max_prompt_tokens"],
+        "sections": dict(sorted(bucket["sections"].items(), key=lambda item: item[1], reverse=True)),
+    }
+
+class UsageTracker:
+    """Prompt/output token accounting per LLM call, aggregated per platform, user and hour"""
+
+    def __init__(self, max_users=MAX_USERS, max_hours=MAX_HOURS, recent=50):
+        self.max_users = max_users
+        self.max_hours = max_hours
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self._total = _empty_bucket()
+        self._platforms = {}
+        self._users = OrderedDict()
+        self._hours = OrderedDict()
+        self._recent = deque(maxlen=recent)
+        self._lock = threading.Lock()
+
+    def record(self, platform, user_id, sections, output_text, latency, usage=None):
+        """Record one LLM call; sections maps a prompt section name to its text"""
+        section_tokens = {name: estimate_tokens(text) for name, text in sections.items()}
+        prompt_tokens = getattr(usage, "prompt_token_count", None) or sum(section_tokens.values())
+        output_tokens = getattr(usage, "candidates_token_count", None) or estimate_tokens(output_text)
+        record = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "platform": platform or "api",
+            "user_id": str(user_id) if user_id else None,
+            "prompt_chars": sum(len(text) for text in sections.values()),
+            "prompt_tokens": prompt_tokens,
+            "output_tokens": output_tokens,
+            "latency_ms": round(latency * 1000, 1),
+            "section_tokens": section_tokens,
+        }
+        hour = record["time"][:13] + ":00"
+        user_key = f"{record['platform']}:{record['user_id']}"
+
+        with self._lock:
+            _add(self._total, record)
+            _add(self._platforms.setdefault(record["platform"], _empty_bucket()), record)
+
+            if record["user_id"]:
+                bucket = self._users.pop(user_key, None) or _empty_bucket()
+                _add(bucket, record)
+                self._users[user_key] = bucket
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+
+            if hour not in self._hours:
+                self._hours[hour] = _empty_bucket()
+                while len(self._hours) > self.max_hours:
+                    self._hours.popitem(last=False)
+            _add(self._hours[hour], record)
+
+            self._recent.append(record)
+
+    def summary(self, top_users=20):
+        with self._lock:
+            users = sorted(self._users.items(), key=lambda item: item[1]["prompt_tokens"], reverse=True)
+            return {
+                "since": self.started,
+                "total": _summarize(self._total),
+                "platforms": {name: _summarize(bucket) for name, bucket in self._platforms.items()},
+                "users": {name: _summarize(bucket) for name, bucket in users[:top_users]},
+                "hours": {hour: _summarize(bucket) for hour, bucket in self._hours.items()},
+                "recent": list(self._recent)[::-1],
+            }
+
+usage_tracker = UsageTracker()